@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import signal
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+from timeit import default_timer as timer
+
+import common as cm
+from modes import points_lines as pl
+from modes import convex_hulls as ch
+from modes import plane_triangulation as pt
+
+
+# Bulk points-lines queries of all points against first 100 points (or segments between first 101 points),
+# vectorized and scalar (same results)
+def distances(points):
+    return pl.distance_matrix(points, points[:100])
+
+
+def distances_scalar(points):
+    return [[pl.euclidean_dist(p, q) for q in points[:100]] for p in points]
+
+
+def projections(points):
+    return pl.orth_projections(points, np.stack((points[:-1][:100], points[1:101]), axis=1))
+
+
+def projections_scalar(points):
+    lines = np.stack((points[:-1][:100], points[1:101]), axis=1)
+    return [min((pl.orth_projection(p, p2, p3) for p2, p3 in lines), key=lambda r: r[2]) for p in points]
+
+
+# Algorithm name to (function, largest amount of points worth running)
+ALGORITHMS = {
+    "jarvis_march": (ch.jarvis_march, 10**6),
+    "graham_scan": (ch.graham_scan, 10**6),
+    "quickhull": (ch.quickhull, 10**7),
+    "monotone_chain": (ch.monotone_chain, 10**6),
+    "chan": (ch.chan, 10**6),
+    "mwt": (pt.mwt, 10**3),
+    "hamiltonian_path": (pt.hamiltonian_path, 10**4),
+    "delaunay": (pt.delaunay, 10**5),
+    "distances": (distances, 10**6),
+    "distances_scalar": (distances_scalar, 10**4),
+    "projections": (projections, 10**6),
+    "projections_scalar": (projections_scalar, 10**4),
+}
+DISTRIBUTIONS = ["normal", "uniform", "circle", "collinear", "duplicates"]
+
+
+class Timeout(Exception):
+    pass
+
+
+# Generates seeded points of given distribution (same ranges as points generated in GUI)
+def generate_points(distribution, amount, seed=0):
+    random = np.random.RandomState(seed)
+    if distribution == "normal":
+        return cm.generate_points(amount, 0, random=random)
+    elif distribution == "uniform":
+        return cm.generate_points(amount, 1, random=random)
+    elif distribution == "circle":
+        # All points on convex hull
+        angles = random.uniform(0, 2 * np.pi, amount)
+        return np.column_stack((np.cos(angles), np.sin(angles))) * 200 + [400, 300]
+    elif distribution == "collinear":
+        x = random.uniform(150, 650, amount)
+        return np.column_stack((x, x * 0.5))
+    elif distribution == "duplicates":
+        # Every point repeated about 10 times
+        unique = cm.generate_points(max(amount // 10, 1), 1, random=random)
+        return unique[random.randint(0, len(unique), amount)]
+
+
+# Runs function on points, raising Timeout if it takes longer than timeout seconds
+def run(function, points, timeout):
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        start = timer()
+        function(points)
+        end = timer()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return (end - start) * 1000
+
+
+# Measures algorithm on points, returns dictionary of median and 95th percentile time in ms and peak memory in MB
+def measure(function, points, repeat, warmup, timeout):
+    for _ in range(warmup):
+        run(function, points, timeout)
+
+    times = [run(function, points, timeout) for _ in range(repeat)]
+
+    tracemalloc.start()
+    try:
+        run(function, points, timeout)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": float(np.median(times)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "peak_mb": peak / 2**20,
+    }
+
+
+def benchmark(algorithms, distributions, max_amount, repeat, warmup, timeout, budget, log=print):
+    results = []
+    for name in algorithms:
+        function, algorithm_max = ALGORITHMS[name]
+        for distribution in distributions:
+            amount = 10
+            while amount <= min(max_amount, algorithm_max):
+                points = generate_points(distribution, amount)
+                result = {"algorithm": name, "distribution": distribution, "amount": amount}
+                try:
+                    result.update(measure(function, points, repeat, warmup, timeout))
+                    result["status"] = "ok"
+                except Timeout:
+                    result["status"] = "timeout"
+                except Exception as e:
+                    result["status"] = "error: {}".format(e)
+                results.append(result)
+
+                log("{:<18} {:<10} {:>9} {}".format(name, distribution, amount, format_result(result)))
+
+                # Stop scaling when too slow (next amount would take about 10 times longer)
+                if result["status"] != "ok" or result["median_ms"] > budget * 1000:
+                    break
+                amount *= 10
+    return results
+
+
+def format_result(result):
+    if result["status"] != "ok":
+        return result["status"]
+    return "median {:10.3f} ms, p95 {:10.3f} ms, peak {:8.2f} MB".format(
+           result["median_ms"], result["p95_ms"], result["peak_mb"])
+
+
+# Compares results against baseline results, returns list of regression descriptions
+def compare(results, baseline, tolerance, min_ms=1):
+    key = lambda r: (r["algorithm"], r["distribution"], r["amount"])
+    base = {key(r): r for r in baseline["results"]}
+    ran = {key(r) for r in results}
+
+    regressions = []
+    for r in results:
+        b = base.get(key(r))
+        if b is None or b["status"] != "ok":
+            continue
+        if r["status"] != "ok":
+            regressions.append("{} {} {}: {} (baseline ok)".format(*key(r), r["status"]))
+        elif r["median_ms"] > b["median_ms"] * (1 + tolerance) and r["median_ms"] - b["median_ms"] > min_ms:
+            regressions.append("{} {} {}: median {:.3f} ms, baseline {:.3f} ms".format(
+                               *key(r), r["median_ms"], b["median_ms"]))
+        elif r["peak_mb"] > b["peak_mb"] * (1 + tolerance) and r["peak_mb"] - b["peak_mb"] > 1:  # Ignore tiny sets
+            regressions.append("{} {} {}: peak {:.2f} MB, baseline {:.2f} MB".format(
+                               *key(r), r["peak_mb"], b["peak_mb"]))
+
+    # Cases no longer reached (amount stopped growing earlier)
+    for b in baseline["results"]:
+        if key(b) not in ran and b["status"] == "ok":
+            regressions.append("{} {} {}: not run (baseline ok)".format(*key(b)))
+    return regressions
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Geometry Calculator benchmark")
+    parser.add_argument("-a", "--algorithms", nargs="+", choices=list(ALGORITHMS), default=list(ALGORITHMS))
+    parser.add_argument("-d", "--distributions", nargs="+", choices=DISTRIBUTIONS, default=DISTRIBUTIONS)
+    parser.add_argument("-n", "--max-amount", type=int, default=10**6, help="largest amount of points")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="measured runs per case")
+    parser.add_argument("-w", "--warmup", type=int, default=1, help="unmeasured runs per case")
+    parser.add_argument("-t", "--timeout", type=float, default=60, help="seconds before a run is stopped")
+    parser.add_argument("--budget", type=float, default=2, help="seconds of median after which amount stops growing")
+    parser.add_argument("-o", "--output", help="save results as JSON")
+    parser.add_argument("-b", "--baseline", help="compare against JSON results")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against baseline")
+    parser.add_argument("--min-ms", type=float, default=1, help="smallest reported slowdown in milliseconds")
+    args = parser.parse_args(args)
+
+    def on_timeout(signum, frame):
+        raise Timeout()
+    signal.signal(signal.SIGALRM, on_timeout)
+
+    results = benchmark(args.algorithms, args.distributions, args.max_amount,
+                        args.repeat, args.warmup, args.timeout, args.budget)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        # Compare only cases selected for this run
+        baseline["results"] = [r for r in baseline["results"] if r["algorithm"] in args.algorithms and
+                               r["distribution"] in args.distributions and r["amount"] <= args.max_amount]
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        for regression in regressions:
+            print("REGRESSION: {}".format(regression))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+import profiler
+
+active = None  # Cache calculations keep results in, None when caching is off
+
+
+# Least recently used cache of calculation results (arrays, tuples and lists of them) within byte budget,
+# optionally also kept in directory (not limited, for reruns of batch jobs)
+class ResultCache():
+    def __init__(self, budget=256 * 2**20, directory=None):
+        self.budget = budget  # Bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # Dictionary of key to (result, size), least recently used first
+        self.size = 0
+        self.hits, self.misses, self.evictions, self.disk_hits = 0, 0, 0, 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+        if self.directory is not None:
+            try:
+                with open(self.path(key), "rb") as f:
+                    result = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                self.disk_hits += 1
+                self.put(key, result, disk=False)
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result, disk=True):
+        size = result_size(result)
+        set_read_only(result)  # Shared by all users of cached result
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+        if size <= self.budget:
+            while self.size + size > self.budget:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            self.entries[key] = (result, size)
+            self.size += size
+
+        if disk and self.directory is not None:
+            path = self.path(key)
+            with open(path + ".tmp{}".format(os.getpid()), "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, path)  # Atomic, other processes never read partial file
+
+    # Returns cached result or calculates it (function without arguments) and caches it
+    def cached(self, key, function):
+        result = self.get(key)
+        if result is not None:
+            with profiler.span("Cached result"):
+                profiler.count("bytes", result_size(result))
+            return result
+
+        result = function()
+        self.put(key, result)
+        return result
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest() + ".pkl")
+
+
+# Enables caching results of calculations
+def enable(budget=256 * 2**20, directory=None):
+    global active
+    active = ResultCache(budget=budget, directory=directory)
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+# Returns hash of points (contents, type and shape), hashing a block at a time (memory maps stay on disk)
+def digest(points, block=2**20):
+    h = hashlib.blake2b(digest_size=16)
+    h.update("{}{}".format(points.dtype.str, points.shape).encode())
+    for start in range(0, len(points), block):
+        h.update(np.ascontiguousarray(points[start:(start + block)]).data)
+    return h.hexdigest()
+
+
+# Returns result of function(points) from active cache under given name, calculating it on miss
+def cached(name, points, function):
+    if active is None:
+        return function(points)
+    return active.cached((digest(points),) + tuple(name), lambda: function(points))
+
+
+# Returns result of calculation of mode (function without arguments) on its points from active cache under given name
+# (same keys as cached()), hash of points is kept in mode.digest until mode resets it to None when points change
+def cached_mode(mode, points, name, function):
+    if active is None:
+        return function()
+    if mode.digest is None:
+        mode.digest = digest(points)
+    return active.cached((mode.digest,) + tuple(name), function)
+
+
+def result_size(result):
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (tuple, list)):
+        return sum(result_size(r) for r in result)
+    return 0
+
+
+def set_read_only(result):
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, (tuple, list)):
+        for r in result:
+            set_read_only(r)
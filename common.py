@@ -1,11 +1,53 @@
 #!/usr/bin/env python3
 
+import sys
 import numpy as np
 
+EPSILON = 0.000001  # Tolerance for comparing floats
+
+
+# Logging interface of modes (parent), prints to standard error so standard output stays free for results,
+# modes can also be given None to not log at all
+class Log():
+    def log(self, text):
+        print("LOG: {}".format(text), file=sys.stderr)
+
+
+# Generates points to fit into smallest window size, 0 - Normal (Gaussian), 1 - Uniform distribution
+def generate_points(amount, distribution, random=np.random):
+    if distribution == 0:
+        # Normal (Gaussian)
+        points = random.normal(loc=300, scale=50.0, size=(amount, 2))
+    else:
+        # Uniform
+        points = random.uniform(low=50.0, high=500.0, size=(amount, 2))
+    points[:, 0] += 100  # X axis is longer, scale correctly in center of smallest window
+    return points
+
+
+# Generates lines (shape (amount, 2, 2)) from generated points in random directions, up to length long
+def generate_lines(amount, distribution, length=50.0, random=np.random):
+    starts = generate_points(amount, distribution, random=random)
+    angles = random.uniform(0, 2 * np.pi, amount)
+    lengths = random.uniform(0, length, amount)
+    ends = starts + np.column_stack((np.cos(angles), np.sin(angles))) * lengths[:, np.newaxis]
+    return np.stack((starts, ends), axis=1)
+
+
+# Converts points to array of shape (amount, 2) without copying float32 and float64 arrays (including read-only
+# memory maps of .npy files), other types are copied to float64
+# Float32 points are never compared directly with tolerance, algorithms promote them to float64 before calculating
+# (differences and their products are exact in float64), so EPSILON applies to both
+def as_points(points):
+    points = np.asarray(points)
+    if points.dtype != np.float32 and points.dtype != np.float64:
+        points = points.astype(float)
+    return points.reshape(-1, 2)
+
 
 # Compares 2 numbers if equal, designed for floats to overcome precision errors
 def almost_equal(a, b):
-    return np.abs(a - b) < 0.000001
+    return np.abs(a - b) < EPSILON
 
 
 # Faster implementation of np.cross() for 2 vectors (3 points) returning magnitude directly
@@ -16,3 +58,20 @@ def area_triangle(a, b, c):
 # Faster implementation of np.cross() for 2 vectors (4 points) returning magnitude directly
 def area_rectangle(a, b, c, d):
     return (a[0] - b[0]) * (c[1] - d[1]) - (a[1] - b[1]) * (c[0] - d[0])
+
+
+# Faster, monotonic replacement for np.arctan2() returning pseudo-angle in range [0, 4) instead of [0, 2pi)
+def pseudo_angle(x, y):
+    s = np.abs(x) + np.abs(y)
+    r = np.divide(x, s, out=np.zeros_like(s, dtype=float), where=(s != 0))
+    return np.where(y >= 0, 1 - r, 3 + r)
+
+
+# Checks on which side of circle through triangle a, b, c (counter-clockwise) point d lies (> 0 inside, < 0 outside)
+def in_circle(a, b, c, d):
+    ax, ay = a[0] - d[0], a[1] - d[1]
+    bx, by = b[0] - d[0], b[1] - d[1]
+    cx, cy = c[0] - d[0], c[1] - d[1]
+    return ((ax * ax + ay * ay) * (bx * cy - cx * by)
+            - (bx * bx + by * by) * (ax * cy - cx * ay)
+            + (cx * cx + cy * cy) * (ax * by - bx * ay))
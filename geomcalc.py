@@ -6,12 +6,44 @@ from timeit import default_timer as timer
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 from matplotlib import lines
+from matplotlib.collections import LineCollection
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
+from PyQt5.QtCore import QThread, pyqtSignal
 
+import cache
+import common as cm
+import profiler
+import progress
+from spatial import PointGrid
 from modes import points_lines as pl
 from modes import convex_hulls as ch
 from modes import plane_triangulation as pt
+from modes import segment_intersections as si
+
+
+# Runs calculation (function without arguments) in background thread, profiling it and reporting its progress
+class CalculationThread(QThread):
+    progressed = pyqtSignal(int, int)  # Done, total (0 if unknown)
+    calculated = pyqtSignal(object, object)  # Result, profile
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, calculate):
+        super().__init__()
+        self.calculate = calculate
+        self.task = progress.Task(self.progressed.emit)
+
+    def run(self):
+        try:
+            with progress.track(self.task), profiler.profile() as prof:
+                result = self.calculate()
+        except progress.Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(repr(e))
+        else:
+            self.calculated.emit(result, prof)
 
 
 class MainWindow(QWidget):
@@ -20,6 +52,16 @@ class MainWindow(QWidget):
 
         self.txt_points = []  # List of tuples (elements)
         self.lines = []  # List of lines
+        self.points_artist = None  # Scatter of calculation points (part of background)
+        self.plotted_points = None  # Points shown by scatter
+        self.lines_artist = None  # Collection of calculation lines (part of background)
+        self.plotted_lines = None  # Lines shown by collection
+        self.points_grid = None  # Grid of points for finding clicked point (built when first clicked)
+        self.gridded_points = None  # Points indexed by grid
+        self.results = []  # Result artists (redrawn over cached background)
+        self.background = None  # Cached background for blitting
+        self.calculation = None  # Running calculation thread
+        self.cache = cache.enable()  # Results of calculations (switching algorithms on the same points)
 
         self.initUI()
 
@@ -29,11 +71,21 @@ class MainWindow(QWidget):
         self.txt_log.setReadOnly(True)
         self.txt_log.setFixedHeight(100)
 
+        # Progress
+        self.pb_progress = QProgressBar()
+        self.pb_progress.setTextVisible(False)
+        self.pb_progress.setMaximumHeight(10)
+
+        self.btn_cancel = QPushButton("Cancel")
+        self.btn_cancel.setDisabled(True)
+        self.btn_cancel.clicked.connect(self.calculation_cancel)
+
         # Graph space
         self.figure = Figure()
         FigureCanvas(self.figure)
         self.figure.canvas.mpl_connect("button_press_event", self.on_plot_click)
         self.figure.canvas.mpl_connect("resize_event", self.on_plot_resize)
+        self.figure.canvas.mpl_connect("draw_event", self.on_plot_draw)
         self.plot = None
 
         # Tabs
@@ -111,10 +163,14 @@ class MainWindow(QWidget):
 
         self.cb_convexalg = QComboBox()
         self.cb_convexalg.setToolTip("Algorithm")
-        self.cb_convexalg.addItems(["Jarvis March", "Graham Scan", "Quickhull"])
-        self.cb_convexalg.setMaximumWidth(100)
+        self.cb_convexalg.addItems(["Jarvis March", "Graham Scan", "Quickhull", "Monotone Chain", "Chan"])
+        self.cb_convexalg.setMaximumWidth(120)
         self.cb_convexalg.currentIndexChanged.connect(self.ch_set_algorithm)
 
+        self.chk_ch_prefilter = QCheckBox("Prefilter")
+        self.chk_ch_prefilter.setToolTip("Discard points inside Akl-Toussaint octagon before calculating")
+        self.chk_ch_prefilter.stateChanged.connect(self.ch_set_prefilter)
+
         btn_convexcalc = QPushButton("Calculate")
         btn_convexcalc.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
         btn_convexcalc.clicked.connect(self.ch_calculate)
@@ -125,6 +181,7 @@ class MainWindow(QWidget):
         tab_ch.layout.addWidget(self.txt_ch_pamount)
         tab_ch.layout.addWidget(btn_ch_pgenerate)
         tab_ch.layout.addStretch()
+        tab_ch.layout.addWidget(self.chk_ch_prefilter)
         tab_ch.layout.addWidget(self.cb_convexalg)
         tab_ch.layout.addWidget(btn_convexcalc)
         tab_ch.setLayout(tab_ch.layout)
@@ -153,10 +210,17 @@ class MainWindow(QWidget):
 
         self.cb_trialg = QComboBox()
         self.cb_trialg.setToolTip("Algorithm")
-        self.cb_trialg.addItems(["Minimum-Weight", "Hamiltonian Path"])
+        self.cb_trialg.addItems(["Minimum-Weight", "Hamiltonian Path", "Delaunay"])
         self.cb_trialg.setMaximumWidth(150)
         self.cb_trialg.currentIndexChanged.connect(self.pt_set_algorithm)
 
+        lbl_pt_neighbours = QLabel("Neighbours:")
+        self.txt_pt_neighbours = QLineEdit()
+        self.txt_pt_neighbours.setToolTip("Limit Minimum-Weight lines to k nearest neighbours (empty - all lines)")
+        self.txt_pt_neighbours.setMaximumWidth(50)
+        self.txt_pt_neighbours.setValidator(QIntValidator(1, 2147483647))
+        self.txt_pt_neighbours.textChanged.connect(self.pt_set_neighbours)
+
         btn_tricalc = QPushButton("Calculate")
         btn_tricalc.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
         btn_tricalc.clicked.connect(self.pt_calculate)
@@ -167,14 +231,55 @@ class MainWindow(QWidget):
         tab_pt.layout.addWidget(self.txt_pt_pamount)
         tab_pt.layout.addWidget(btn_pt_pgenerate)
         tab_pt.layout.addStretch()
+        tab_pt.layout.addWidget(lbl_pt_neighbours)
+        tab_pt.layout.addWidget(self.txt_pt_neighbours)
         tab_pt.layout.addWidget(self.cb_trialg)
         tab_pt.layout.addWidget(btn_tricalc)
         tab_pt.setLayout(tab_pt.layout)
 
+        # Tab - Segment Intersections
+        self.si = si.SegmentIntersections(self)
+
+        tab_si = QWidget()
+        self.tabs.addTab(tab_si, "Segment Intersections")
+
+        self.cb_si_distribution = QComboBox()
+        self.cb_si_distribution.setToolTip("Line start point distribution")
+        self.cb_si_distribution.addItems(["Normal (Gaussian)", "Uniform"])
+        self.cb_si_distribution.setMaximumWidth(150)
+
+        lbl_si_lamount = QLabel("Amount:")
+        self.txt_si_lamount = QLineEdit()
+        self.txt_si_lamount.setText("100")
+        self.txt_si_lamount.setToolTip("Amount of lines")
+        self.txt_si_lamount.setMaximumWidth(50)
+        self.txt_si_lamount.setValidator(QIntValidator(0, 2147483647))
+
+        btn_si_lgenerate = QPushButton("Generate Lines")
+        btn_si_lgenerate.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
+        btn_si_lgenerate.clicked.connect(self.si_generate_lines)
+
+        btn_sicalc = QPushButton("Calculate")
+        btn_sicalc.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Expanding)
+        btn_sicalc.clicked.connect(self.si_calculate)
+
+        tab_si.layout = QHBoxLayout()
+        tab_si.layout.addWidget(self.cb_si_distribution)
+        tab_si.layout.addWidget(lbl_si_lamount)
+        tab_si.layout.addWidget(self.txt_si_lamount)
+        tab_si.layout.addWidget(btn_si_lgenerate)
+        tab_si.layout.addStretch()
+        tab_si.layout.addWidget(btn_sicalc)
+        tab_si.setLayout(tab_si.layout)
+
         # Layout
         vbox = QVBoxLayout()
         vbox.addWidget(self.tabs)
         vbox.addWidget(self.figure.canvas)
+        hbox_progress = QHBoxLayout()
+        hbox_progress.addWidget(self.pb_progress)
+        hbox_progress.addWidget(self.btn_cancel)
+        vbox.addLayout(hbox_progress)
         vbox.addWidget(self.txt_log)
 
         # Window
@@ -189,6 +294,47 @@ class MainWindow(QWidget):
         self.txt_log.append(str(text))
         print("LOG: {}".format(text))
 
+    def log_profile(self, prof):
+        for line in prof.lines():
+            self.log(line)
+        self.log("Result cache: {} results in {:.1f} MB (hits: {}, misses: {}, evictions: {})".format(
+            len(self.cache), self.cache.size / 2**20, self.cache.hits, self.cache.misses, self.cache.evictions))
+
+    def closeEvent(self, event):
+        if self.calculation is not None:
+            self.calculation.task.cancel()
+            self.calculation.wait()
+        event.accept()
+
+    # Runs calculation in background, calling on_result(result, profile) when finished (UI is locked until then)
+    def calculation_start(self, calculate, on_result):
+        self.tabs.setDisabled(True)
+        self.btn_cancel.setDisabled(False)
+        self.pb_progress.setRange(0, 0)  # Busy until first progress
+
+        self.calculation = CalculationThread(calculate)
+        self.calculation.progressed.connect(self.on_calculation_progress)
+        self.calculation.calculated.connect(on_result)
+        self.calculation.cancelled.connect(lambda: self.log("Calculation cancelled"))
+        self.calculation.failed.connect(lambda error: self.log("Calculation failed: {}".format(error)))
+        self.calculation.finished.connect(self.on_calculation_end)
+        self.calculation.start()
+
+    def calculation_cancel(self):
+        if self.calculation is not None:
+            self.calculation.task.cancel()
+
+    def on_calculation_progress(self, done, total):
+        self.pb_progress.setRange(0, total)  # Busy if total is unknown (0)
+        self.pb_progress.setValue(done)
+
+    def on_calculation_end(self):
+        self.calculation = None
+        self.tabs.setDisabled(False)
+        self.btn_cancel.setDisabled(True)
+        self.pb_progress.setRange(0, 1)
+        self.pb_progress.setValue(0)
+
     def on_plot_click(self, event):
         if event.xdata is not None and event.ydata is not None:
             if self.tabs.currentIndex() == 0:
@@ -204,11 +350,22 @@ class MainWindow(QWidget):
                     elif npatches == 3:
                         self.plot_connection(self.pl.p3, (event.xdata, event.ydata))
                 self.pl_update_ui(self.pl, self.txt_points, replot=False)
+            elif self.tabs.currentIndex() == 1 and self.calculation is None:
+                self.ch_update_point((event.xdata, event.ydata), remove=event.button == 3)
 
     def on_plot_resize(self, event):
         self.plot.set_xlim((0, event.width))
         self.plot.set_ylim((0, event.height))
 
+    def on_plot_draw(self, event):
+        if self.plot is None:
+            return
+
+        # Cache everything except results (animated) as background, then draw results over it
+        self.background = self.figure.canvas.copy_from_bbox(self.plot.bbox)
+        for artist in self.results:
+            self.plot.draw_artist(artist)
+
     def plot_clear(self, force=False):
         self.figure.clf()
         self.plot = self.figure.add_axes([0, 0, 1, 1])
@@ -218,10 +375,21 @@ class MainWindow(QWidget):
         self.plot.set_ylim((0, self.height() - 234))
 
         self.lines = []
+        self.points_artist = None
+        self.plotted_points = None
+        self.lines_artist = None
+        self.plotted_lines = None
+        self.results = []
+        self.background = None
 
         if force:
             self.figure.canvas.draw()
 
+    def plot_clear_results(self):
+        for artist in self.results:
+            artist.remove()
+        self.results = []
+
     def plot_point(self, p, text="", num=False, color="black", instant=True):
         x, y = p
         self.plot.scatter(int(x), int(y), marker="o", s=2, color=color)
@@ -247,6 +415,66 @@ class MainWindow(QWidget):
     def plot_connection(self, p1, p2, color="black", temp=False):
         self.plot_line([p1[0], p2[0]], [p1[1], p2[1]], color=color, temp=temp)
 
+    # Plots calculation points as background, reusing scatter if already plotted
+    def plot_points(self, points):
+        if self.points_artist is None:
+            self.points_artist = self.plot.scatter(points[:, 0], points[:, 1], marker="o", s=2, color="black")
+        elif self.plotted_points is not points:
+            self.points_artist.set_offsets(points)
+        else:
+            return  # Already plotted, background is still valid
+        self.plotted_points = points
+        self.figure.canvas.draw()  # Full redraw, caches new background
+
+    # Plots calculation lines (array of point pairs) as background, reusing collection if already plotted
+    def plot_segments(self, lines):
+        if self.lines_artist is None:
+            self.lines_artist = LineCollection(lines, colors="black", linewidths=0.5)
+            self.plot.add_collection(self.lines_artist)
+        elif self.plotted_lines is not lines:
+            self.lines_artist.set_segments(lines)
+        else:
+            return  # Already plotted, background is still valid
+        self.plotted_lines = lines
+        self.figure.canvas.draw()  # Full redraw, caches new background
+
+    # Plots many points as one result artist
+    def plot_scatter(self, points, color="black", size=10):
+        artist = self.plot.scatter(points[:, 0], points[:, 1], marker="o", s=size, color=color, animated=True)
+        self.results.append(artist)
+
+    # Plots many lines (array of point pairs) as one result artist
+    def plot_lines(self, pt_lines, color="black", linewidth=1):
+        collection = LineCollection(pt_lines, colors=color, linewidths=linewidth, animated=True)
+        self.plot.add_collection(collection)
+        self.results.append(collection)
+
+    # Plots connected points as one result artist
+    def plot_path(self, points, color="black", linewidth=1, markersize=2):
+        line = lines.Line2D(points[:, 0], points[:, 1], marker="o", markersize=markersize, linewidth=linewidth,
+                            color=color, animated=True)
+        self.plot.add_line(line)
+        self.results.append(line)
+
+    # Redraws results over cached background (full redraw if there is no background yet)
+    def plot_blit(self):
+        canvas = self.figure.canvas
+        if self.background is None:
+            canvas.draw()  # Caches background and draws results
+            return
+
+        canvas.restore_region(self.background)
+        for artist in self.results:
+            self.plot.draw_artist(artist)
+        canvas.blit(self.plot.bbox)
+
+    # Returns index of point nearest to p, reusing grid of points while points stay the same
+    def nearest_point(self, points, p):
+        if self.gridded_points is not points:
+            self.points_grid = PointGrid(points)
+            self.gridded_points = points
+        return self.points_grid.nearest(p)
+
     def plot_get_points(self):
         return self.plot.collections  # ax.scatter() + ...
 
@@ -254,21 +482,13 @@ class MainWindow(QWidget):
         return self.plot.get_lines()  # ax.plot() + lines.Line2D() + ...
 
     def generate_points(self, amount, distribution):
-        self.plot_clear()
+        self.plot_clear_results()
 
         start = timer()
-        # Generate points to fit into smallest window size
-        if distribution == 0:
-            # Normal (Gaussian)
-            points = np.random.normal(loc=300, scale=50.0, size=(amount, 2))
-        else:
-            # Uniform
-            points = np.random.uniform(low=50.0, high=500.0, size=(amount, 2))
-        points[:, 0] += 100  # X axis is longer, scale correctly in center of smallest window
+        points = cm.generate_points(amount, distribution)
         end = timer()
 
-        self.plot.scatter(points[:, 0], points[:, 1], marker="o", s=2, color="black")
-        self.figure.canvas.draw()
+        self.plot_points(points)
 
         self.log("Generated {} points in {} ms".format(amount, int((end - start) * 1000)))
         return points
@@ -355,24 +575,59 @@ class MainWindow(QWidget):
     def ch_calculate(self):
         if len(self.ch.points) == 0:
             self.ch_generate_points()
-        else:
-            self.plot_clear()
 
-        # Redraw points (clean lines)
-        self.plot.scatter(self.ch.points[:, 0], self.ch.points[:, 1], marker="o", s=2, color="black")
-        self.figure.canvas.draw()
+        # Clean previous results (points stay in background)
+        self.plot_clear_results()
+        self.plot_points(self.ch.points)
+        self.plot_blit()
+
+        # Calculate convex hull (in background, drawn when finished)
+        self.calculation_start(self.ch.calculate, self.ch_draw)
 
-        # Calculate convex hull
-        ch_points = self.ch.calculate()
+    def ch_draw(self, ch_points, prof):
+        self.log_profile(prof)
         if ch_points.all():
             # Draw convex hull
-            self.plot.plot(ch_points[:, 0], ch_points[:, 1], marker="o", markersize=2, linewidth=1, color="red")
+            self.plot_path(ch_points, color="red")
             # self.plot.scatter(ch_points[:, 0], ch_points[:, 1], marker="o", s=10, color="red")  # Debug
-            self.figure.canvas.draw()
+            self.plot_blit()
+
+    # Adds point (or removes nearest point), updating convex hull dynamically
+    def ch_update_point(self, p, remove=False):
+        start = timer()
+        if remove:
+            if len(self.ch.points) == 0:
+                return
+            i = self.nearest_point(self.ch.points, p)
+            p = self.ch.points[i].copy()  # Row of points buffer is overwritten by removal
+            self.points_grid.delete(i)
+            self.ch.remove_point(p, i)
+            self.gridded_points = self.ch.points
+        else:
+            points = self.ch.points
+            self.ch.add_point(p)
+            if self.gridded_points is points:
+                self.points_grid.insert(p)
+                self.gridded_points = self.ch.points
+        ch_points = self.ch.calculate_dynamic()
+        end = timer()
+
+        self.plot_clear_results()
+        self.plot_points(self.ch.points)
+        if len(ch_points) > 0:
+            self.plot_path(ch_points, color="red")
+        self.plot_blit()
+
+        self.log("{} point ({:.0f}, {:.0f}), convex hull has {} points ({} rebuilds) in {:.3f} ms".format(
+                 "Removed" if remove else "Added", p[0], p[1], max(len(ch_points) - 1, 0), self.ch.dynamic.rebuilds,
+                 (end - start) * 1000))
 
     def ch_set_algorithm(self):
         self.ch.set_algorithm(self.cb_convexalg.currentIndex())
 
+    def ch_set_prefilter(self):
+        self.ch.set_prefilter(self.chk_ch_prefilter.isChecked())
+
     def pt_generate_points(self):
         if not self.txt_pt_pamount.text():
             print("Invalid amount of points!")
@@ -387,43 +642,90 @@ class MainWindow(QWidget):
     def pt_calculate(self):
         if len(self.pt.points) == 0:
             self.pt_generate_points()
-        else:
-            self.plot_clear()
 
-        # Redraw points (clean lines)
-        self.plot.scatter(self.pt.points[:, 0], self.pt.points[:, 1], marker="o", s=2, color="black")
-        self.figure.canvas.draw()
+        # Clean previous results (points stay in background)
+        self.plot_clear_results()
+        self.plot_points(self.pt.points)
+        self.plot_blit()
 
-        # Calculate plane triangulation
-        start = timer()
-        pt_lines, (s_points, pt_points) = self.pt.calculate()  # PT lines (MWT), Spiral points, PT points (Hamiltonian)
-        end = timer()
+        # Calculate plane triangulation (in background, drawn when finished)
+        self.calculation_start(self.pt.calculate, self.pt_draw)
+
+    def pt_draw(self, result, prof):
+        pt_lines, (s_points, pt_points) = result  # PT lines (MWT), Spiral points, PT points (Hamiltonian)
 
-        # Draw Minimum-Weight triangulation lines
+        # Draw Minimum-Weight (or Delaunay) triangulation lines
         if pt_lines.any():
-            for line in pt_lines:
-                self.plot_connection(line[0], line[1], color="red")
+            self.plot_lines(pt_lines, color="red")
 
         # Draw spiral
         if s_points.any():
-            self.plot.plot(s_points[:, 0], s_points[:, 1], marker="o", markersize=1, linewidth=1, color="black")
+            self.plot_path(s_points, color="black", markersize=1)
             # for i, p in enumerate(s_points):
             #     self.plot_point(p, text=i)  # Debug
 
         # Draw plane triangulation
         if pt_points.any():
-            self.plot.plot(pt_points[:, 0], pt_points[:, 1], marker="o", markersize=0.5, linewidth=0.5, color="red")
+            self.plot_path(pt_points, color="red", linewidth=0.5, markersize=0.5)
             # for i, p in enumerate(pt_points):
             #     self.plot_point(p, text=i)  # Debug
 
-        self.figure.canvas.draw()
+        self.plot_blit()
 
-        self.log("Calculated plane triangulation on {} points using {} algorithm in {} ms".format(
-                 len(self.pt.points), self.cb_trialg.currentText(), int((end - start) * 1000)))
+        self.log_profile(prof)
 
     def pt_set_algorithm(self):
         self.pt.set_algorithm(self.cb_trialg.currentIndex())
 
+    def pt_set_neighbours(self):
+        text = self.txt_pt_neighbours.text()
+        self.pt.set_neighbours(int(text) if text else None)
+
+    def si_generate_lines(self):
+        if not self.txt_si_lamount.text():
+            print("Invalid amount of lines!")
+            return
+
+        amount = int(self.txt_si_lamount.text())
+        distribution = self.cb_si_distribution.currentIndex()
+
+        self.plot_clear_results()
+
+        start = timer()
+        si_lines = cm.generate_lines(amount, distribution)
+        end = timer()
+
+        self.si.set_lines(si_lines)
+        self.plot_segments(self.si.lines)
+
+        self.log("Generated {} lines in {} ms".format(amount, int((end - start) * 1000)))
+
+    def si_calculate(self):
+        if len(self.si.lines) == 0:
+            self.si_generate_lines()
+
+        # Clean previous results (lines stay in background)
+        self.plot_clear_results()
+        self.plot_segments(self.si.lines)
+        self.plot_blit()
+
+        # Calculate segment intersections (in background, drawn when finished)
+        self.calculation_start(self.si.calculate, self.si_draw)
+
+    def si_draw(self, result, prof):
+        si_points, si_pairs, si_types = result
+
+        # Draw all intersections at once, colored by type (crossing red, touching blue, coincident green)
+        if len(si_points) > 0:
+            colors = np.array(["black", "black", "green", "blue", "red"])[si_types]
+            self.plot_scatter(si_points, color=colors)
+        self.plot_blit()
+
+        self.log_profile(prof)
+        self.log("Found {} intersections, {} touches and {} coincident lines".format(
+                 np.count_nonzero(si_types == pl.ITYPE_INTERSECTION), np.count_nonzero(si_types == pl.ITYPE_TOUCH),
+                 np.count_nonzero(si_types == pl.ITYPE_COINCIDENT)))
+
 
 if __name__ == "__main__":
     # Create Qt application with window
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+from contextlib import nullcontext
+from itertools import islice
+import numpy as np
+from timeit import default_timer as timer
+
+import cache
+import common as cm
+import profiler
+from modes import points_lines as pl
+from modes import convex_hulls as ch
+from modes import plane_triangulation as pt
+from modes import segment_intersections as si
+
+CH_ALGORITHMS = ["jarvis", "graham", "quickhull", "monotone", "chan"]
+PT_ALGORITHMS = ["mwt", "hamiltonian", "delaunay"]
+PL_MODES = ["distance", "projection", "intersection"]
+DISTRIBUTIONS = ["normal", "uniform"]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Geometry Calculator (headless)")
+    parser.add_argument("mode", choices=["hull", "triangulation", "points-lines", "intersections"],
+                        help="calculation to run (intersections of lines given as point pairs)")
+    parser.add_argument("-a", "--algorithm", help="hull: {} (default quickhull), triangulation: {} "
+                        "(default mwt), points-lines: {} (default distance)".format(
+                            ", ".join(CH_ALGORITHMS), ", ".join(PT_ALGORITHMS), ", ".join(PL_MODES)))
+    parser.add_argument("-i", "--input", help="points file (.npy or text with X and Y columns)")
+    parser.add_argument("-g", "--generate", type=int, metavar="AMOUNT", help="generate points instead of reading")
+    parser.add_argument("-d", "--distribution", choices=DISTRIBUTIONS, default="normal",
+                        help="distribution of generated points")
+    parser.add_argument("-s", "--seed", type=int, help="random seed for generated points")
+    parser.add_argument("-o", "--output", help="result file (.npy or text), standard output if not given")
+    parser.add_argument("-p", "--prefilter", action="store_true", help="hull: use Akl-Toussaint prefilter")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="hull: processes for large inputs (default 1, 0 - all cores)")
+    parser.add_argument("-c", "--chunk", type=int, metavar="SIZE",
+                        help="hull: read input in chunks of SIZE points (for inputs larger than memory)")
+    parser.add_argument("-k", "--neighbours", type=int, help="triangulation: limit MWT lines to k nearest neighbours")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log timings to standard error")
+    parser.add_argument("--profile", metavar="FILE", help="write phase timings and counters as JSON")
+    parser.add_argument("--trace", metavar="FILE", help="write phase timings in Chrome trace format")
+    parser.add_argument("--cache", metavar="DIR", help="reuse results of previous runs on the same points kept in DIR")
+    args = parser.parse_args(args)
+
+    # Algorithm names depend on mode
+    algorithms = {"hull": CH_ALGORITHMS, "triangulation": PT_ALGORITHMS, "points-lines": PL_MODES}.get(args.mode, [])
+    if args.algorithm is not None and not algorithms:
+        parser.error("argument -a/--algorithm: {} has no algorithms".format(args.mode))
+    if args.algorithm is not None and args.algorithm not in algorithms:
+        parser.error("argument -a/--algorithm: invalid choice for {}: '{}' (choose from {})".format(
+            args.mode, args.algorithm, ", ".join(algorithms)))
+    return args
+
+
+def read_points(path):
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return np.loadtxt(path, delimiter="," if path.endswith(".csv") else None, ndmin=2)
+
+
+# Yields points of file in chunks (slices of memory map for .npy, blocks of lines for text)
+def read_chunks(path, size):
+    if path.endswith(".npy"):
+        points = np.load(path, mmap_mode="r")
+        for start in range(0, len(points), size):
+            yield points[start:(start + size)]
+        return
+
+    with open(path) as f:
+        while True:
+            lines = list(islice(f, size))
+            if not lines:
+                break
+            yield np.loadtxt(lines, delimiter="," if path.endswith(".csv") else None, ndmin=2)
+
+
+def write_result(path, result):
+    if path is None:
+        np.savetxt(sys.stdout, result, fmt="%.17g")
+    elif path.endswith(".npy"):
+        np.save(path, result)
+    else:
+        np.savetxt(path, result, fmt="%.17g", delimiter="," if path.endswith(".csv") else " ")
+
+
+def main(args):
+    args = parse_args(args)
+    log = cm.Log() if args.verbose else None
+
+    # Get points
+    if args.chunk is not None and args.mode == "hull" and args.input is not None:
+        points = read_chunks(args.input, args.chunk)  # Read while calculating
+    elif args.generate is not None:
+        random = np.random.RandomState(args.seed) if args.seed is not None else np.random
+        start = timer()
+        if args.mode == "intersections":
+            points = cm.generate_lines(args.generate, DISTRIBUTIONS.index(args.distribution), random=random)
+        else:
+            points = cm.generate_points(args.generate, DISTRIBUTIONS.index(args.distribution), random=random)
+        end = timer()
+        if log is not None:
+            log.log("Generated {} {} in {} ms".format(args.generate, "lines" if args.mode == "intersections" else
+                                                      "points", int((end - start) * 1000)))
+    elif args.input is not None:
+        points = read_points(args.input)
+    else:
+        print("Error! Input file or amount of points to generate required!", file=sys.stderr)
+        return 1
+
+    if args.cache is not None:
+        cache.enable(directory=args.cache)
+
+    # Calculate (profiling phases only if timings are wanted)
+    with profiler.profile() if log is not None or args.profile or args.trace else nullcontext() as prof:
+        result = calculate(args, points, log=log)
+
+    if prof is not None:
+        if log is not None:
+            for line in prof.lines():
+                log.log(line)
+        if args.profile:
+            with open(args.profile, "w") as f:
+                f.write(prof.to_json())
+        if args.trace:
+            with open(args.trace, "w") as f:
+                f.write(prof.to_chrome_trace())
+
+    if log is not None and cache.active is not None:
+        log.log("Result cache hits: {}, from disk: {}, misses: {}".format(
+            cache.active.hits, cache.active.disk_hits, cache.active.misses))
+
+    if result is not None:
+        write_result(args.output, result)
+    return 0
+
+
+# Runs calculation of selected mode, returns result to write (None if already printed)
+def calculate(args, points, log=None):
+    if args.mode == "hull" and args.chunk is not None:
+        if args.input is None:
+            points = (points[i:(i + args.chunk)] for i in range(0, len(points), args.chunk))  # Chunks of generated
+        algorithm = CH_ALGORITHMS.index(args.algorithm or "quickhull")
+        result = ch.streaming(points, algorithm=algorithm, prefilter=args.prefilter, main=log)
+    elif args.mode == "hull":
+        hulls = ch.ConvexHulls()
+        hulls.set_algorithm(CH_ALGORITHMS.index(args.algorithm or "quickhull"))
+        hulls.set_prefilter(args.prefilter)
+        hulls.set_workers(args.workers or None)
+        hulls.set_points(points)
+        result = hulls.calculate()  # Convex hull points (first point repeated at end)
+    elif args.mode == "triangulation":
+        triangulation = pt.PlaneTriangulation()
+        triangulation.set_algorithm(PT_ALGORITHMS.index(args.algorithm or "mwt"))
+        triangulation.set_neighbours(args.neighbours)
+        triangulation.set_points(points)
+        pt_lines, (s_points, pt_points) = triangulation.calculate()
+        if triangulation.algorithm == 1:
+            result = pt_points  # Triangle strip points
+        else:
+            result = pt_lines.reshape(-1, 4)  # Lines (X1, Y1, X2, Y2)
+    elif args.mode == "intersections":
+        intersections = si.SegmentIntersections()
+        intersections.set_lines(points)  # Rows of X1, Y1, X2, Y2 or pairs of X, Y rows
+        si_points, si_pairs, si_types = intersections.calculate()
+        result = np.column_stack((si_points, si_pairs, si_types))  # X, Y, line indexes and type code
+    else:
+        points_lines = pl.PointsLines()
+        points_lines.set_mode(PL_MODES.index(args.algorithm or "distance"))
+        points = np.zeros((4, 2)) if len(points) == 0 else np.asarray(points, dtype=float)
+        points_lines.set_points(np.vstack((points, np.zeros((4, 2))))[:4])  # Unused points are zero
+        _, text, _, _, _ = points_lines.calculate()
+        print(text)
+        return None
+
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,314 +1,1039 @@
 #!/usr/bin/env python3
 
+import os
+import bisect
 import numpy as np
+from multiprocessing import Pool, shared_memory
+from time import perf_counter_ns
 from timeit import default_timer as timer
 
+import cache
 import common as cm
-from modes import points_lines as pl
+import profiler
+import progress
 
 
 class ConvexHulls():
-    def __init__(self, parent):
-        self.parent = parent
-        self.algorithm = 0  # 0 - Jarvis, 1 - Graham, 2 - Quickhull
-        self.points = np.array([])
+    def __init__(self, parent=None):
+        self.parent = parent  # Object with log(text) method (main window, common.Log) or None
+        self.algorithm = 0  # 0 - Jarvis, 1 - Graham, 2 - Quickhull, 3 - Monotone Chain, 4 - Chan
+        self.prefilter = False  # Discard points inside Akl-Toussaint octagon before calculating
+        self.workers = 1  # Processes calculating convex hull of large point sets (None - all cores)
+        self.points = np.empty((0, 2))
+        self.buffer = None  # Growable copy of points for point updates (points are its first rows)
+        self.dynamic = None  # Dynamic convex hull of points (created on first point update)
+        self.digest = None  # Hash of points for result cache (calculated when first needed)
 
     def set_algorithm(self, algorithm):
         self.algorithm = algorithm
 
+    def set_prefilter(self, prefilter):
+        self.prefilter = prefilter
+
+    def set_workers(self, workers):
+        self.workers = workers
+
     def set_points(self, points):
-        self.points = np.array(points, dtype=float)
+        self.points = cm.as_points(points)  # No copy of float32 and float64 arrays (memory maps stay on disk)
+        self.buffer = None
+        self.dynamic = None
+        self.digest = None
+
+    # Adds point, updating dynamic convex hull instead of recalculating, points are kept in a growable buffer
+    # (doubled when full), so adding does not copy all points
+    def add_point(self, p):
+        if self.dynamic is None:
+            self.dynamic = DynamicConvexHull(self.points)
+        self.dynamic.insert(p)
+        amount = len(self.points)
+        if self.buffer is None or amount == len(self.buffer):
+            buffer = np.empty((max(2 * amount, 16), 2))
+            buffer[:amount] = self.points
+            self.buffer = buffer
+        self.buffer[amount] = p
+        self.points = self.buffer[:amount + 1]
+        self.digest = None
+
+    # Removes point (first if duplicated, or at index i if known), updating dynamic convex hull instead of
+    # recalculating, later points move one index lower in the buffer
+    def remove_point(self, p, i=None):
+        if self.dynamic is None:
+            self.dynamic = DynamicConvexHull(self.points)
+        self.dynamic.delete(p)
+        amount = len(self.points)
+        if i is None:
+            i = np.flatnonzero((self.points[:, 0] == p[0]) & (self.points[:, 1] == p[1]))[0]
+        if self.buffer is None:
+            self.buffer = np.array(self.points, dtype=float)  # Set points are not changed
+        self.buffer[i:(amount - 1)] = self.buffer[(i + 1):amount]
+        self.points = self.buffer[:(amount - 1)]
+        self.digest = None
+
+    # Returns convex hull kept by point updates (or calculates it using Monotone Chain if points were only set)
+    def calculate_dynamic(self):
+        if self.dynamic is None:
+            self.dynamic = DynamicConvexHull(self.points)
+        return self.dynamic.hull()
 
     def calculate(self):
+        return cache.cached_mode(self, self.points, ("convex hull", self.algorithm, self.prefilter),
+                                 self.calculate_uncached)
+
+    # Calculates convex hull without result cache (parts of larger calculations, e.g. batch sets and chunks)
+    def calculate_uncached(self):
+        if self.workers != 1:
+            return parallel(self.points, algorithm=self.algorithm, prefilter=self.prefilter, workers=self.workers,
+                            main=self.parent)
+
+        points = self.points
+        if self.prefilter:
+            points = akl_toussaint(points, main=self.parent)
+
         if self.algorithm == 0:
-            return jarvis_march(self.points, main=self.parent)
+            return jarvis_march(points, main=self.parent)
         elif self.algorithm == 1:
-            return graham_scan(self.points, main=self.parent)
+            return graham_scan(points, main=self.parent)
         elif self.algorithm == 2:
-            return quickhull(self.points, main=self.parent)
-
-
-def jarvis_march(points, main=None):
+            return quickhull(points, main=self.parent)
+        elif self.algorithm == 3:
+            return monotone_chain(points, main=self.parent)
+        elif self.algorithm == 4:
+            return chan(points, main=self.parent)
+
+
+# Calculates convex hulls of many point sets in a process pool, point sets are given as a list of arrays or
+# as flat array of points with offsets (set i is points[offsets[i]:offsets[i + 1]]), convex hulls are returned
+# in the same flat layout together with calculation time of each set
+@profiler.profiled("Batch convex hulls")
+def batch(points, offsets=None, algorithm=2, prefilter=False, workers=None, main=None):
+    if offsets is None:
+        offsets = np.concatenate(([0], np.cumsum([len(p) for p in points], dtype=int)))
+        points = np.concatenate(points) if len(points) > 0 else np.empty((0, 2))
+    points = np.ascontiguousarray(points, dtype=float)
+    offsets = np.asarray(offsets, dtype=int)
+    amount = len(offsets) - 1
+    workers = workers or os.cpu_count()
+    profiler.count("sets", amount)
+    profiler.count("points", len(points))
+    profiler.count("workers", workers)
+
+    if workers == 1 or amount < 2:
+        results = batch_worker(points, offsets, algorithm, prefilter)
+    else:
+        # Share points with workers instead of pickling them, each worker gets consecutive sets
+        shm = shared_memory.SharedMemory(create=True, size=max(points.nbytes, 1))
+        try:
+            np.ndarray(points.shape, dtype=points.dtype, buffer=shm.buf)[:] = points
+            with Pool(workers) as pool:
+                chunks = np.array_split(np.arange(amount), workers * 4)
+                tasks = [(shm.name, points.shape, offsets[c[0]:(c[-1] + 2)], algorithm, prefilter)
+                         for c in chunks if len(c) > 0]
+                results = [r for rs in pool.starmap(batch_shared_worker, tasks) for r in rs]
+        finally:
+            shm.close()
+            shm.unlink()
+
+    ch_points = [r[0] for r in results]
+    ch_offsets = np.concatenate(([0], np.cumsum([len(p) for p in ch_points], dtype=int)))
+    ch_points = np.concatenate(ch_points) if amount > 0 else np.empty((0, 2))
+    times = np.array([r[1] for r in results])
+
+    return ch_points, ch_offsets, times
+
+
+# Calculates convex hulls of point sets in shared memory (offsets relative to start of shared points)
+def batch_shared_worker(name, shape, offsets, algorithm, prefilter):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        points = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        return batch_worker(points, offsets, algorithm, prefilter)
+    finally:
+        shm.close()
+
+
+# Calculates convex hulls of point sets, returning list of (convex hull points, time in ms)
+def batch_worker(points, offsets, algorithm, prefilter):
+    hulls = ConvexHulls()
+    hulls.set_algorithm(algorithm)
+    hulls.set_prefilter(prefilter)
+
+    results = []
+    for o1, o2 in zip(offsets[:-1], offsets[1:]):
+        start = timer()
+        if o2 > o1:
+            hulls.set_points(points[o1:o2])
+            ch_points = np.array(hulls.calculate_uncached())  # Copy (might be a view of shared memory)
+        else:
+            ch_points = np.empty((0, 2))
+        end = timer()
+        results.append((ch_points, (end - start) * 1000))
+    return results
+
+
+# Calculates convex hull of large point set in a process pool, each worker calculates convex hull of consecutive
+# part of points (in shared memory), convex hull of their convex hulls is calculated at the end,
+# calculates serially if there are less points than threshold (starting processes would take longer)
+@profiler.profiled("Parallel convex hull")
+def parallel(points, algorithm=2, prefilter=False, workers=None, threshold=1000000, main=None):
+    points = cm.as_points(points)
     amount = len(points)
+    workers = workers or os.cpu_count()
+    profiler.count("points", amount)
+
+    hulls = ConvexHulls()
+    hulls.set_algorithm(algorithm)
+    hulls.set_prefilter(prefilter)
+
+    if workers == 1 or amount < max(threshold, workers * 3):
+        hulls.set_points(points)
+        return hulls.calculate_uncached()
+
+    profiler.count("workers", workers)
+
+    # Share points with workers instead of pickling them
+    with profiler.span("Split points"):
+        shm = shared_memory.SharedMemory(create=True, size=points.nbytes)
+        try:
+            np.ndarray(points.shape, dtype=points.dtype, buffer=shm.buf)[:] = points
+            bounds = np.linspace(0, amount, workers + 1).astype(int)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+    try:
+        with profiler.span("Calculate partial convex hulls"):
+            with Pool(workers) as pool:
+                tasks = [(shm.name, points.shape, points.dtype.str, start, end, algorithm, prefilter)
+                         for start, end in zip(bounds[:-1], bounds[1:])]
+                results = pool.starmap(parallel_worker, tasks)
+
+            for w, (ch_points, start, end) in enumerate(results):
+                profiler.add("Worker {}".format(w + 1), end - start,
+                             {"points": int(bounds[w + 1] - bounds[w]), "convex hull points": len(ch_points) - 1},
+                             start=start, track=w + 1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Find convex hull of partial convex hulls
+    with profiler.span("Merge partial convex hulls"):
+        hulls.set_points(np.concatenate([ch_points[:-1] for ch_points, _, _ in results]))
+        ch_points = hulls.calculate_uncached()
 
-    start_extreme = timer()
+    return ch_points
 
-    # Find extreme point (start of convex hull)
-    points = points[np.lexsort((points[:, 0], points[:, 1]))]
-    e = points[0]
 
-    end_extreme = timer()
+# Calculates convex hull of part of points in shared memory, returning it with start and end time (nanoseconds)
+def parallel_worker(name, shape, dtype, start, end, algorithm, prefilter):
+    time_start = perf_counter_ns()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        hulls = ConvexHulls()
+        hulls.set_algorithm(algorithm)
+        hulls.set_prefilter(prefilter)
+        hulls.set_points(np.ndarray(shape, dtype=dtype, buffer=shm.buf)[start:end])
+        ch_points = np.array(hulls.calculate_uncached())  # Copy (might be a view of shared memory)
+    finally:
+        shm.close()
+    return ch_points, time_start, perf_counter_ns()
+
+
+# Calculates convex hull of points given as iterable of chunks (arrays, e.g. slices of memory-mapped .npy file),
+# merging convex hull of each chunk into convex hull so far, so only one chunk and convex hull are kept in memory
+@profiler.profiled("Streaming convex hull")
+def streaming(chunks, algorithm=2, prefilter=False, main=None):
+    hulls = ConvexHulls()
+    hulls.set_algorithm(algorithm)
+    hulls.set_prefilter(prefilter)
+
+    ch_points = np.empty((0, 2))
+    amount = 0
+    start = last = timer()
+    for chunk in chunks:
+        chunk = cm.as_points(chunk)
+        if len(chunk) == 0:
+            continue
+
+        # Find convex hull of chunk, then of it together with convex hull so far
+        hulls.set_points(chunk)
+        chunk_ch = hulls.calculate_uncached()[:-1]  # Without final connection
+        hulls.set_points(np.vstack((ch_points[:-1], chunk_ch)))
+        ch_points = hulls.calculate_uncached()
+
+        amount += len(chunk)
+        profiler.count("chunks")
+        progress.update(amount)
+
+        now = timer()
+        if main is not None and now - last >= 1:
+            main.log("Processed {} points ({:.0f} points/s), convex hull has {} points"
+                     .format(amount, amount / (now - start), len(ch_points) - 1))
+            last = now
+
+    end = timer()
+    profiler.count("points", amount)
 
-    # if main is not None:
-    #     main.plot_point(e, text="E", color="blue")  # Debug
+    if main is not None:
+        main.log("Calculated streaming convex hull on {} points ({:.0f} points/s), convex hull has {} points"
+                 .format(amount, amount / max(end - start, 1e-9), max(len(ch_points) - 1, 0)))
 
-    start_first = timer()
+    return ch_points
 
-    # Find second point by calculating angles to all points (smallest angle)
-    min_angle, min_i = np.inf, -1
-    for i, p in enumerate(points[1:]):
-        angle = np.arctan2(p[1] - e[1], p[0] - e[0])
-        if cm.almost_equal(angle, min_angle):
-            # Take smaller distance if same angles
-            if pl.euclidean_dist(e, p) < pl.euclidean_dist(e, points[min_i]):
-                min_angle, min_i = angle, i + 1
-        elif angle < min_angle:
-            min_angle, min_i = angle, i + 1
 
-    end_first = timer()
+# Returns indexes of 8 extreme points forming (possibly degenerate) octagon in counter-clockwise order (min Y,
+# max X - Y, max X, max X + Y, max Y, min X - Y, min X, min X + Y) of points (shape (N, 2)) or of each group
+# (shape (G, N, 2))
+def octagon_extremes(points):
+    x, y = points[..., 0], points[..., 1]
+    s, d = x + y, x - y
+    return np.stack((y.argmin(axis=-1), d.argmax(axis=-1), x.argmax(axis=-1), s.argmax(axis=-1),
+                     y.argmax(axis=-1), d.argmin(axis=-1), x.argmin(axis=-1), s.argmin(axis=-1)), axis=-1)
+
+
+# Returns which points (shape (N, 2)) are strictly inside octagon (shape (8, 2)), left of all its lines skipping
+# degenerate ones (nothing is inside octagon without area), or the same for groups (shapes (G, N, 2) and (G, 8, 2))
+def octagon_inside(octagon, points):
+    ps = np.moveaxis(points, -1, 0)  # X and Y first, as in area_triangle()
+    inside = np.ones(points.shape[:-1], dtype=bool)
+    lines = np.zeros(points.shape[:-2] + (1,), dtype=int)
+    for a, b in zip(np.moveaxis(octagon, -2, 0), np.moveaxis(np.roll(octagon, -1, axis=-2), -2, 0)):
+        degenerate = np.all(a == b, axis=-1)[..., np.newaxis]
+        a, b = np.moveaxis(a, -1, 0)[..., np.newaxis], np.moveaxis(b, -1, 0)[..., np.newaxis]
+        inside &= degenerate | (cm.area_triangle(b, ps, a) < 0)
+        lines += ~degenerate
+    return inside & (lines >= 3)
+
+
+@profiler.profiled("Akl-Toussaint prefilter")
+def akl_toussaint(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
 
-    ch_points = np.vstack((e, points[min_i]))
-    points = np.concatenate((points[:min_i], points[(min_i + 1):]))
+    if amount < 3:
+        return points
 
-    start_other = timer()
+    # Find 8 extreme points forming (possibly degenerate) octagon, in counter-clockwise order
+    octagon = points[octagon_extremes(points)].astype(float)  # Line tests in float64 also for float32 points
 
-    # Find all other points
-    pi = ch_points[-1]
-    while not np.array_equal(pi, e):
-        min_angle, min_i = np.inf, -1
-        for i, p in enumerate(points):
-            a = pi - ch_points[-2]  # Vector from previous point to last point
-            b = p - pi  # Vector from last point to new point
-            angle = np.arctan2(b[1], b[0]) - np.arctan2(a[1], a[0])
-            if angle < 0:
-                angle += 2 * np.pi  # Bring into positive
-
-            if cm.almost_equal(angle, min_angle):
-                # Take smaller distance if same angles
-                if pl.euclidean_dist(pi, p) < pl.euclidean_dist(pi, points[min_i]):
-                    min_angle, min_i = angle, i
-            elif angle < min_angle:
-                min_angle, min_i = angle, i
-
-        ch_points = np.vstack((ch_points, points[min_i]))
-        points = np.concatenate((points[:min_i], points[(min_i + 1):]))
-        pi = ch_points[-1]
-
-    end_other = timer()
+    # if main is not None:
+    #     main.plot.plot(octagon[:, 0], octagon[:, 1], linewidth=1, color="blue")  # Debug
 
-    if main is not None:
-        time_extreme = (end_extreme - start_extreme) * 1000
-        time_first = (end_first - start_first) * 1000
-        time_other = (end_other - start_other) * 1000
-        main.log("Calculated convex hull on {} points using Jarvis March algorithm in {} ms:"
-                 .format(amount, int(time_extreme + time_first + time_other)))
-        main.log("- Found extreme point in {} ms".format(int(time_extreme)))
-        main.log("- Found second point using extreme in {} ms".format(int(time_first)))
-        main.log("- Found all remaining points in {} ms".format(int(time_other)))
+    # Find points strictly inside octagon (left of all its lines)
+    inside = octagon_inside(octagon, points)
 
-    return ch_points
+    points = points[~inside]  # Copy of remaining points only
+    profiler.count("discarded", amount - len(points))
 
+    return points
 
-def graham_scan(points, main=None):
+
+@profiler.profiled("Jarvis March")
+def jarvis_march(points, main=None):
     amount = len(points)
+    profiler.count("points", amount)
 
     if amount < 3:
-        if main is not None:
-            main.log("Calculated convex hull on {} points using Graham Scan algorithm in 0 ms:".format(amount))
         return np.vstack((points, points[0]))  # Connect first and last
 
-    # Approximate center of gravity
-    rands = np.random.choice(points.shape[0], 3, replace=False)
-    o = np.mean([points[rands[0]], points[rands[1]], points[rands[2]]], axis=0)
+    # Find extreme point (start of convex hull)
+    with profiler.span("Find extreme point"):
+        min_y_i = np.flatnonzero(points[:, 1] == points[:, 1].min())
+        e_i = min_y_i[points[min_y_i, 0].argmin()]
+        e = points[e_i]
 
     # if main is not None:
-    #     main.plot_point(o, text="O", color="blue")  # Debug
+    #     main.plot_point(e, text="E", color="blue")  # Debug
+
+    # Points still available for wrapping (extreme point stays available to close the hull)
+    alive = np.ones(amount, dtype=bool)
+    ch_i = np.empty(amount + 1, dtype=int)  # Convex hull point indexes
+    ch_i[0] = e_i
 
-    start_polar = timer()
+    # Find second point by calculating angles to all points (smallest angle from X axis)
+    with profiler.span("Find second point using extreme"):
+        ch_i[1] = jarvis_march_step(points, np.flatnonzero(alive), e_i, np.array([1.0, 0.0]), e_i)
+        alive[ch_i[1]] = False
 
-    # Create polar system and sort all points based on angle
-    angles = []
-    for p in points:
-        angle = np.arctan2(p[1] - o[1], p[0] - o[0])
-        if angle < 0:
-            angle += 2 * np.pi
-        angles.append(angle)
+    # Find all other points
+    with profiler.span("Find all remaining points"):
+        h = 2
+        while not np.array_equal(points[ch_i[h - 1]], e):
+            a = points[ch_i[h - 1]].astype(float) - points[ch_i[h - 2]]  # Vector from previous point to last point
+            ch_i[h] = jarvis_march_step(points, np.flatnonzero(alive), ch_i[h - 1], a, e_i)
+            alive[ch_i[h]] = False
+            h += 1
+            progress.update(h)
+        profiler.count("wrapping steps", h - 1)
+
+    ch_points = points[ch_i[:h]]
 
-    angles = np.array(angles)
-    points = points[angles.argsort()]
+    return ch_points
 
-    end_polar = timer()
 
-    start_extreme = timer()
+# Finds index of next convex hull point (out of indexes candidates) from last point (index pi_i) and previous
+# direction (vector a), closing on extreme point (index e_i) if only duplicates of last point are left, of points on
+# the same line takes closest (keeping all points on convex hull lines) or farthest (keeping only corners)
+def jarvis_march_step(points, candidates, pi_i, a, e_i, farthest=False):
+    b = points[candidates] - points[pi_i].astype(float)  # Vectors from last point to all candidates (float64)
+    distances = b[:, 0]**2 + b[:, 1]**2
 
-    # Find extreme point (start of convex hull)
-    e_i = np.lexsort((points[:, 0], points[:, 1]))[0]
-    e = points[e_i]
+    # Turn angle between vectors, pseudo-angle preserves ordering of real angles
+    angles = cm.pseudo_angle(a[0] * b[:, 0] + a[1] * b[:, 1], a[0] * b[:, 1] - a[1] * b[:, 0])
+    angles[distances == 0] = np.inf  # Ignore duplicates of last point
+
+    min_angle = angles.min()
+    if np.isinf(min_angle):
+        return e_i  # Only duplicates left, close on extreme point
+
+    # Take smallest distance if same angles
+    ties = np.flatnonzero(cm.almost_equal(angles, min_angle))
+    if not farthest:
+        return candidates[ties[distances[ties].argmin()]]
+
+    # Take smallest exact angle (or largest distance if on the same line) of almost same angles
+    best = ties[0]
+    for t in ties[1:]:
+        u = b[best, 0] * b[t, 1] - b[best, 1] * b[t, 0]
+        if u < 0 or (u == 0 and distances[t] > distances[best]):
+            best = t
+    return candidates[best]
+
+
+@profiler.profiled("Graham Scan")
+def graham_scan(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
 
-    end_extreme = timer()
+    if amount < 3:
+        return np.vstack((points, points[0]))  # Connect first and last
+
+    # Points on the same line have no polar order around their center (also on the line), only keep both ends
+    with profiler.span("Check points on the same line"):
+        min_y_i = np.flatnonzero(points[:, 1] == points[:, 1].min())
+        max_y_i = np.flatnonzero(points[:, 1] == points[:, 1].max())
+        e1_i = min_y_i[points[min_y_i, 0].argmin()]  # Min Y (min X if same)
+        e2_i = max_y_i[points[max_y_i, 0].argmax()]  # Max Y (max X if same)
+        e1, e2 = points[[e1_i, e2_i]].astype(float)
+        if not cm.area_triangle(e2, points.T, e1).any():
+            return points[[e1_i, e2_i, e1_i]]  # Connect first and last
+
+    with profiler.span("Create and sort polar system"):
+        # Center of gravity (always inside convex hull, deterministic)
+        o = points.mean(axis=0, dtype=float)
+
+        # if main is not None:
+        #     main.plot_point(o, text="O", color="blue")  # Debug
+
+        # Create polar system and sort all points based on angle (closer first if same angles)
+        v = points - o
+        angles = cm.pseudo_angle(v[:, 0], v[:, 1])
+        distances = v[:, 0]**2 + v[:, 1]**2
+        del v
+        order = np.lexsort((distances, angles))
+
+    # Find extreme point (start of convex hull), first in polar order if duplicated
+    with profiler.span("Find extreme point"):
+        min_y_i = np.flatnonzero(points[:, 1] == points[:, 1].min())
+        min_y_i = min_y_i[points[min_y_i, 0] == points[min_y_i, 0].min()]
+        ranks = np.empty(amount, dtype=int)
+        ranks[order] = np.arange(amount)
+        e_i = ranks[min_y_i].min()
 
     # if main is not None:
-    #     main.plot_point(e, text="E", color="blue")  # Debug
+    #     main.plot_point(points[order[e_i]], text="E", color="blue")  # Debug
 
-    start_other = timer()
+    with profiler.span("Find all remaining points"):
+        # Walk around polar system starting at extreme point, keeping only left turns
+        order = np.roll(order, -e_i)
+        stack = monotone_chain_pass(iter_points(points, order))
 
-    # Find all other points
-    p2 = None
-    j = 0
-    while not np.array_equal(p2, e) or j < 3:
-        i1, i2, i3 = e_i % len(points), (e_i + 1) % len(points), (e_i + 2) % len(points)
-        p1, p2, p3 = points[i1], points[i2], points[i3]
-        u = cm.area_triangle(p2, p1, p3)
-        if u > 0:
-            # Point p2 is part of convex hull, keep and continue
-            e_i += 1
-            j += 1
-        else:
-            # Point p2 is not part of convex hull, remove and return
-            points = np.concatenate((points[:i2], points[(i2 + 1):]))
-            e_i -= 2
-            j -= 2
+        # Remove points not forming left turn with extreme point
+        ps = points[order[stack]].tolist()
+        top = len(stack)
+        while top > 2 and cm.area_triangle(ps[top - 1], ps[top - 2], ps[0]) <= 0:
+            top -= 1
 
-    end_other = timer()
+        points = points[order[stack[:top]]]
 
     ch_points = np.vstack((points, points[0]))  # Connect first and last
 
-    if main is not None:
-        time_polar = (end_polar - start_polar) * 1000
-        time_extreme = (end_extreme - start_extreme) * 1000
-        time_other = (end_other - start_other) * 1000
-        main.log("Calculated convex hull on {} points using Graham Scan algorithm in {} ms:"
-                 .format(amount, int(time_polar + time_extreme + time_other)))
-        main.log("- Created and sorted polar system {} ms".format(int(time_polar)))
-        main.log("- Found extreme point in {} ms".format(int(time_extreme)))
-        main.log("- Found all remaining points in {} ms".format(int(time_other)))
-
     return ch_points
 
 
+@profiler.profiled("Quickhull")
 def quickhull(points, main=None):
     amount = len(points)
+    profiler.count("points", amount)
 
     if amount < 3:
-        if main is not None:
-            main.log("Calculated convex hull on {} points using Quickhull algorithm in 0 ms:".format(amount))
         return np.vstack((points, points[0]))  # Connect first and last
 
-    start_extreme = timer()
-
     # Find extreme points (start of convex hull)
-    sort_i = np.lexsort((points[:, 1], points[:, 0]))
-    e1, e2 = points[sort_i[[0, -1]]]
-
-    end_extreme = timer()
+    with profiler.span("Find first extreme points"):
+        min_x_i = np.flatnonzero(points[:, 0] == points[:, 0].min())
+        max_x_i = np.flatnonzero(points[:, 0] == points[:, 0].max())
+        e1_i = min_x_i[points[min_x_i, 1].argmin()]  # Min X (min Y if same)
+        e2_i = max_x_i[points[max_x_i, 1].argmax()]  # Max X (max Y if same)
+        e1, e2 = points[[e1_i, e2_i]].astype(float)  # Line tests in float64 also for float32 points
 
     # if main is not None:
     #     main.plot_point(e1, text="E1", color="blue")  # Debug
     #     main.plot_point(e2, text="E2", color="blue")  # Debug
     #     main.plot_connection(e1, e2, color="blue", temp=True)  # Debug
 
-    ch_points = np.vstack((e1, e2))
+    # Split into 2 areas (below and above line between extreme points)
+    with profiler.span("Split first areas"):
+        u = cm.area_triangle(e2, points.T, e1)
+        s1 = np.flatnonzero(u > 0)  # Below (right of line E1-E2)
+        s2 = np.flatnonzero(u < 0)  # Above (right of line E2-E1)
+        profiler.count("pruned", amount - len(s1) - len(s2))
 
-    start_first = timer()
+    # Find all other points
+    with profiler.span("Find all remaining points"):
+        ch_i = quickhull_split(points, e1_i, e2_i, s1) + quickhull_split(points, e2_i, e1_i, s2)
 
-    # Split into 2 areas (start of recursion)
-    s1 = []
-    s2 = []
-    for p in points:
-        u = cm.area_triangle(e1, p, e2)
-        if u > 0:  # Left
-            s1.append(p)
-            # if main is not None:
-            #     main.plot_point(p, text="1", color="blue")  # Debug
-        elif u < 0:  # Right
-            s2.append(p)
-            # if main is not None:
-            #     main.plot_point(p, text="2", color="blue")  # Debug
+    ch_points = points[ch_i + [ch_i[0]]]  # Connect first and last
 
-    end_first = timer()
+    return ch_points
 
-    start_other = timer()
 
-    # Find all other points
-    if s1:
-        sub_ch_points1 = quickhull_sub(s1, e1, e2, main=main)
-        if sub_ch_points1.any():
-            ch_points = np.vstack((ch_points, sub_ch_points1))
-    if s2:
-        sub_ch_points2 = quickhull_sub(s2, e2, e1, main=main)
-        if sub_ch_points2.any():
-            ch_points = np.vstack((ch_points, sub_ch_points2))
-
-    end_other = timer()
-
-    # Sort convex hull points based on angle from approximate center (for visualization)
-    rands = np.random.choice(ch_points.shape[0], 3, replace=False)
-    o = np.mean([ch_points[rands[0]], ch_points[rands[1]], ch_points[rands[2]]], axis=0)
-
-    angles = []
-    for p in ch_points:
-        angle = np.arctan2(p[1] - o[1], p[0] - o[0])
-        if angle < 0:
-            angle += 2 * np.pi
-        angles.append(angle)
-
-    angles = np.array(angles)
-    ch_points = ch_points[angles.argsort()]
-    ch_points = np.vstack((ch_points, ch_points[0]))  # Connect first and last
+# Finds convex hull points right of line between points a and b (out of indexes s), returns their indexes
+# in counter-clockwise order starting with a (without b)
+def quickhull_split(points, a_i, b_i, s):
+    # Walk lines counter-clockwise so points are found in order
+    # Stack of lines (start, end, indexes of points right of line), first line on top
+    ch_i = []
+    stack = [(a_i, b_i, s)]
+    while stack:
+        progress.update(len(ch_i))
+        a_i, b_i, s = stack.pop()
+        if len(s) == 0:
+            # No points outside of line, start point is next convex hull point
+            ch_i.append(a_i)
+            continue
+
+        m_i = quickhull_max(points, s, a_i, b_i)
+        a, b, m = points[[a_i, b_i, m_i]].astype(float)
+
+        # Split into 2 areas outside of triangle (ignoring points inside triangle)
+        ps = points[s].T
+        u1 = cm.area_triangle(m, ps, a)
+        u2 = cm.area_triangle(b, ps, m)
+        s1 = s[u1 > 0]  # Right of line A-M
+        s2 = s[(u2 > 0) & (u1 <= 0)]  # Right of line M-B
+
+        stack.append((m_i, b_i, s2))
+        stack.append((a_i, m_i, s1))
+
+    return ch_i
+
+
+# Peels convex layers (convex hulls of points left after removing outer layers) using Quickhull,
+# returns layer of each point and counter-clockwise ordered point indexes of each layer,
+# each layer is found only out of candidates outside inner octagon (points inside it are inside the layer if the layer
+# contains the octagon), candidates about square root of points times points of layer are found again out of all
+# points left only when a layer does not contain the octagon, so evenly spread points take about O(n * sqrt(L)) for
+# L layers instead of O(n * L) (still O(n * L) if octagon has no area, e.g. all points on the same line), besides
+# Quickhull steps for each point (taking most of the time up to about 10^5 points)
+@profiler.profiled("Convex layers")
+def convex_layers(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
+
+    # Sort once by X, then by Y, first and last point left are always extreme points of next layer
+    order = np.lexsort((points[:, 1], points[:, 0]))
+    alive = np.ones(amount, dtype=bool)
+    layer_ids = np.full(amount, -1, dtype=int)
+    layers = []
+
+    ids = order  # Points left (only updated when finding candidates)
+    candidates, octagon = ids, None
+    left, band, failures = amount, amount, 0
+    while left > 0:
+        progress.update(amount - left, amount)
+        ch_i = convex_layers_hull(points, candidates)
+
+        if octagon is not None and not convex_layers_contain(points, ch_i, octagon):
+            # Points inside octagon can be on layer, find more candidates
+            failures += 1
+            ids = ids[alive[ids]]
+            candidates, octagon = convex_layers_candidates(points, ids, band * 2**failures)
+            continue
+
+        layer_ids[ch_i] = len(layers)
+        layers.append(ch_i)
+
+        # Remove layer from points left
+        alive[ch_i] = False
+        left -= len(ch_i)
+        candidates = candidates[alive[candidates]]
+
+        if octagon is None or len(candidates) == 0:
+            ids = ids[alive[ids]] if octagon is not None else candidates
+            band, failures = int(np.sqrt(left * len(ch_i))) + 1, 0
+            candidates, octagon = convex_layers_candidates(points, ids, band)
+            profiler.count("candidate searches")
+
+    profiler.count("layers", len(layers))
+
+    return layer_ids, layers
+
+
+# Finds counter-clockwise ordered convex hull points of points with indexes ids (sorted by X, then by Y) using
+# Quickhull, returns their indexes
+def convex_layers_hull(points, ids):
+    e1_i, e2_i = ids[0], ids[-1]
+    if e1_i == e2_i:
+        return np.array([e1_i])
+
+    # Split into 2 areas (below and above line between extreme points)
+    e1, e2 = points[[e1_i, e2_i]].astype(float)
+    u = cm.area_triangle(e2, points[ids].T, e1)
+    return np.array(quickhull_split(points, e1_i, e2_i, ids[u > 0]) + quickhull_split(points, e2_i, e1_i, ids[u < 0]))
+
+
+# Finds candidates for next convex layers out of points with indexes ids (sorted by X, then by Y), band points
+# outside octagon of 8 extreme points shrunk towards its center, returns their indexes (still sorted) and shrunk
+# octagon (None if all points are candidates)
+def convex_layers_candidates(points, ids, band):
+    if band >= len(ids):
+        return ids, None
+
+    ps = points[ids].astype(float)  # Line tests in float64 also for float32 points
+    octagon = ps[octagon_extremes(ps)]
+    octagon = octagon[np.any(octagon != np.roll(octagon, 1, axis=0), axis=1)]  # Skip degenerate lines
+    if len(octagon) < 3:
+        return ids, None
+    o = octagon.mean(axis=0)
+
+    # Scale of octagon (around center O) each point is on, octagon without area has no inside
+    scales = np.full(len(ids), -np.inf)
+    for a, b in zip(octagon, np.roll(octagon, -1, axis=0)):
+        edge = cm.area_rectangle(b, a, a, o)
+        if not edge < 0:
+            return ids, None
+        scales = np.maximum(scales, cm.area_rectangle(b, a, ps.T, o) / edge)
+
+    scale = np.partition(scales, len(ids) - band)[len(ids) - band]
+    return ids[scales >= scale], o + (octagon - o) * scale
+
+
+# Checks if convex layer (indexes ch_i, counter-clockwise) contains octagon (strictly inside)
+def convex_layers_contain(points, ch_i, octagon):
+    if len(ch_i) < 3:
+        return False
+
+    ch_p = points[ch_i].astype(float)
+    ch_q = np.roll(ch_p, -1, axis=0)
+    return all(np.all(cm.area_triangle(ch_q.T, ch_p.T, p) > 0) for p in octagon)
+
+
+# Finds index of point (out of indexes s) farthest from line between points a and b (on its right side)
+def quickhull_max(points, s, a_i, b_i):
+    a, b = points[[a_i, b_i]].astype(float)
+    areas = cm.area_triangle(b, points[s].T, a)
+    max_s = np.flatnonzero(areas == areas.max())
+    if len(max_s) > 1:
+        # Take point closest to A if same area (extreme point of line parallel to A-B)
+        ps = points[s[max_s]]
+        max_s = max_s[[((ps - a) @ (b - a)).argmin()]]
+    return s[max_s[0]]
+
+
+@profiler.profiled("Monotone Chain")
+def monotone_chain(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
 
-    if main is not None:
-        time_extreme = (end_extreme - start_extreme) * 1000
-        time_first = (end_first - start_first) * 1000
-        time_other = (end_other - start_other) * 1000
-        main.log("Calculated convex hull on {} points using Quickhull algorithm in {} ms:"
-                 .format(amount, int(time_extreme + time_first + time_other)))
-        main.log("- Found first extreme points in {} ms".format(int(time_extreme)))
-        main.log("- Split first areas in {} ms".format(int(time_first)))
-        main.log("- Found all remaining points in {} ms".format(int(time_other)))
+    if amount < 3:
+        return np.vstack((points, points[0]))  # Connect first and last
+
+    # Sort points by X, then by Y
+    with profiler.span("Sort points"):
+        order = np.lexsort((points[:, 1], points[:, 0]))
+
+    # Find lower hull walking left to right
+    with profiler.span("Find lower hull"):
+        lower = monotone_chain_pass(iter_points(points, order))
+
+    # Find upper hull walking right to left
+    with profiler.span("Find upper hull"):
+        upper = monotone_chain_pass(iter_points(points, order[::-1]))
+
+    ch_i = lower[:-1] + [amount - 1 - i for i in upper[:-1]]  # Last point of each is first point of the other
+    ch_points = points[order[ch_i + [ch_i[0]]]]  # Connect first and last
 
     return ch_points
 
 
-def quickhull_sub(s, e1, e2, main=None):
-    # Find biggest triangle area for s
-    max_area, max_p, max_i = -np.inf, None, -1
-    for i, p in enumerate(s):
-        area = cm.area_triangle(e1, p, e2)
-        if cm.almost_equal(area, max_area):
-            # Take biggest angle if same area
-            a = p - e1  # Vector from e1 to point
-            b = e2 - p  # Vector from e2 to point
-            angle1 = np.arctan2(b[1], b[0]) - np.arctan2(a[1], a[0])
+# Walks points (tuples in walking order) keeping only left turns, returns positions of half of convex hull in walk
+def monotone_chain_pass(ps):
+    stack, stack_p = [], []
+    for i, p in enumerate(ps):
+        while len(stack) > 1 and cm.area_triangle(stack_p[-1], stack_p[-2], p) <= 0:
+            stack.pop()  # Point is not part of convex hull, remove
+            stack_p.pop()
+        stack.append(i)
+        stack_p.append(p)
+    return stack
+
+
+# Yields points (tuples of plain floats, faster to work with than NumPy rows) in given index order,
+# converting a block at a time so all points are never copied at once
+def iter_points(points, order, block=65536):
+    for start in range(0, len(order), block):
+        progress.update(start, len(order))
+        ps = points[order[start:(start + block)]]
+        yield from zip(ps[:, 0].tolist(), ps[:, 1].tolist())
+
+
+# Chan's algorithm, output-sensitive O(n * log(h)) for convex hull of h points: rounds with groups of m points take
+# O(n * log(m)) to sort groups and find their hulls and O(h * n / m * log(m)) to wrap them, m squares each round
+# until m >= h
+@profiler.profiled("Chan")
+def chan(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
 
-            a = max_p - e1  # Vector from e1 to point
-            b = e2 - max_p  # Vector from e2 to point
-            angle2 = np.arctan2(b[1], b[0]) - np.arctan2(a[1], a[0])
+    if amount < 3:
+        return np.vstack((points, points[0]))  # Connect first and last
 
-            if angle1 > angle2:
-                max_area, max_p, max_i = area, p, i
+    # Guess convex hull size (squaring each round) until wrapping closes in time, starting with groups of 256 points
+    # (smaller groups take more time to wrap than they save finding group hulls)
+    t = 3
+    ch_points = None
+    while ch_points is None:
+        m = min(2 ** (2 ** t), amount)
 
-        elif area > max_area:
-            max_area, max_p, max_i = area, p, i
+        with profiler.span("Round {}".format(t)):
+            profiler.count("group size", m)
 
-    # if main is not None:
-    #     main.plot_point(max_p, text="M", color="blue")  # Debug
-    #     main.plot_connection(e1, max_p, color="blue", temp=True)  # Debug
-    #     main.plot_connection(e2, max_p, color="blue", temp=True)  # Debug
-
-    ch_points = np.array([max_p])
-
-    # Split into 2 areas outside of triangle (ignoring points inside triangle)
-    s1 = []
-    s2 = []
-    for p in s[:max_i] + s[(max_i + 1):]:
-        u1 = cm.area_triangle(e1, p, max_p)
-        u2 = cm.area_triangle(max_p, p, e2)
-        if u1 > 0 and u2 < 0:  # Right of one line
-            s1.append(p)
-            # if main is not None:
-            #     main.plot_point(p, text="1", color="blue")  # Debug
-        elif u2 > 0 and u1 < 0:  # Right of the other line
-            s2.append(p)
-            # if main is not None:
-            #     main.plot_point(p, text="2", color="blue")  # Debug
-
-    if s1:
-        sub_ch_points1 = quickhull_sub(s1, e1, max_p)
-        if sub_ch_points1.any():
-            ch_points = np.vstack((ch_points, sub_ch_points1))
-    if s2:
-        sub_ch_points2 = quickhull_sub(s2, max_p, e2)
-        if sub_ch_points2.any():
-            ch_points = np.vstack((ch_points, sub_ch_points2))
+            # Find convex hulls of groups of at most m points (counter-clockwise, only corners)
+            with profiler.span("Find group hulls"):
+                g_points, offsets = chan_group_hulls(points, m)
+                profiler.count("groups", len(offsets) - 1)
+                profiler.count("group hull points", len(g_points))
+
+            with profiler.span("Wrap group hulls"):
+                # Find extreme point (start of convex hull)
+                min_y_i = np.flatnonzero(g_points[:, 1] == g_points[:, 1].min())
+                e_i = min_y_i[g_points[min_y_i, 0].argmin()]
+
+                # Wrap group hulls using Jarvis March on tangents of each group hull, giving up after m points
+                if len(offsets) - 1 > 16:
+                    ch_i = chan_wrap(g_points, offsets, e_i, m)
+                else:
+                    ch_i = chan_wrap_few(g_points, offsets, e_i, m)  # Plain Python is faster for few groups
+                profiler.count("wrapping steps", len(ch_i) - 1)
+
+                if ch_i[-1] == e_i:
+                    ch_points = g_points[ch_i]
+
+        t += 1
 
     return ch_points
+
+
+# Finds convex hulls of groups of m consecutive points, returns their points (counter-clockwise, only corners) one
+# group after another and offsets of groups in them (groups + 1 offsets), each group is sorted by X, then by Y on its
+# own, many small groups are walked all at once with NumPy (a block of groups at a time, so all points are never
+# copied at once), few large groups each using Monotone Chain
+def chan_group_hulls(points, m, block=2**18):
+    amount = len(points)
+
+    group_i, offsets = [], [0]
+    if m > 256:
+        for g in range(0, amount, m):
+            progress.update(g, amount)
+            order = g + np.lexsort((points[g:(g + m), 1], points[g:(g + m), 0]))
+            if len(order) < 3:
+                group_i.append(order)
+            else:
+                group = list(zip(points[order, 0].tolist(), points[order, 1].tolist()))
+                lower = monotone_chain_pass(group)
+                upper = monotone_chain_pass(reversed(group))
+                group_i.append(order[lower[:-1] + [len(group) - 1 - i for i in upper[:-1]]])
+            offsets.append(offsets[-1] + len(group_i[-1]))
+    else:
+        for start in range(0, amount, block // m * m):
+            progress.update(start, amount)
+            corners, counts = chan_group_hulls_block(points, start, min(start + block // m * m, amount), m)
+            group_i.append(corners)
+            offsets.extend(offsets[-1] + np.cumsum(counts))
+
+    return points[np.concatenate(group_i)], np.array(offsets)
+
+
+# Finds convex hulls of groups of m consecutive points from start to end all at once with NumPy, returns point indexes
+# of their corners (counter-clockwise) one group after another and amount of corners of each group
+def chan_group_hulls_block(points, start, end, m):
+    groups = -(-(end - start) // m)
+
+    # Fill last group with copies of last point (duplicates are never kept as corners), sort each group
+    g_order = np.concatenate((np.arange(start, end), np.repeat(end - 1, groups * m - (end - start)))).reshape(groups, m)
+    ps = points[g_order].astype(float, copy=False)
+    rows = np.arange(groups)[:, np.newaxis]
+    cols = np.lexsort((ps[:, :, 1], ps[:, :, 0]), axis=-1)
+    g_order = g_order[rows, cols]
+    ps = ps[rows, cols]
+
+    # Skip points strictly inside octagon of 8 extreme points of their group (same as Akl-Toussaint prefilter),
+    # moving remaining points to the front of their group (still sorted) and filling with copies of last one
+    inside = octagon_inside(ps[rows, octagon_extremes(ps)], ps)
+
+    left = m - inside.sum(axis=1)
+    cols = np.argsort(inside, axis=1, kind="stable")[:, :left.max()]
+    cols = np.where(np.arange(cols.shape[1]) < left[:, np.newaxis], cols, cols[rows[:, 0], left - 1][:, np.newaxis])
+    g_order = g_order[rows, cols]
+    ps = ps[rows, cols]
+    m = cols.shape[1]
+    profiler.count("skipped", inside.sum())
+
+    # Last point of each half is first point of the other
+    lower, lower_top = monotone_chain_groups(ps)
+    upper, upper_top = monotone_chain_groups(ps[:, ::-1])
+    stacks = np.hstack((lower, m - 1 - upper))
+    keep = np.hstack((np.arange(m) < lower_top[:, np.newaxis] - 1, np.arange(m) < upper_top[:, np.newaxis] - 1))
+
+    return g_order[np.nonzero(keep)[0], stacks[keep]], keep.sum(axis=1)
+
+
+# Walks groups of points (shape (groups, m, 2), each group in walking order) all at once keeping only left turns,
+# returns positions of half of convex hull of each group in walk (rows of stack) and their amounts
+def monotone_chain_groups(ps):
+    groups, m = ps.shape[:2]
+    x, y = ps[:, :, 0].ravel(), ps[:, :, 1].ravel()
+    starts = np.arange(0, groups * m, m)
+    stack = np.zeros(groups * m, dtype=int)  # Stack of each group in its row (flat indexes of points)
+    top = starts.copy()  # Flat index of next free place in stack
+    for i in range(m):
+        p = x[starts + i], y[starts + i]
+        g = np.flatnonzero(top - starts > 1)
+        while len(g) > 0:
+            b, c = stack[top[g] - 1], stack[top[g] - 2]
+            g = g[cm.area_triangle((x[b], y[b]), (x[c], y[c]), (p[0][g], p[1][g])) <= 0]
+            top[g] -= 1  # Point is not part of convex hull, remove
+            g = g[top[g] - starts[g] > 1]
+        stack[top] = starts + i
+        top += 1
+    return stack.reshape(groups, m) - starts[:, np.newaxis], top - starts
+
+
+# Wraps group hulls (points one group after another, separated by offsets) from extreme point (index e_i) using
+# Jarvis March on tangents of each group hull, returns indexes of at most m + 1 convex hull points (ending with e_i
+# if closed in time)
+def chan_wrap(g_points, offsets, e_i, m):
+    xy = g_points.T.astype(float)
+    ch_i = [e_i]
+    a = np.array([1.0, 0.0])  # Start with smallest angle from X axis
+    for _ in range(m):
+        progress.update(len(ch_i))
+        candidates = chan_tangents(xy, offsets, ch_i[-1])
+        pi_i = jarvis_march_step(g_points, candidates, ch_i[-1], a, e_i, farthest=True)
+        if np.array_equal(g_points[pi_i], g_points[e_i]):
+            ch_i.append(e_i)  # Connect first and last
+            break
+        a = g_points[pi_i].astype(float) - g_points[ch_i[-1]]  # Vector from previous point to last point
+        ch_i.append(pi_i)
+    return ch_i
+
+
+# Same as chan_wrap() using plain Python on each group hull, next point is tangent of all group hulls with
+# all other tangents on its left (farthest if on the same line)
+def chan_wrap_few(g_points, offsets, e_i, m):
+    hulls = [g_points[o1:o2].astype(float).tolist() for o1, o2 in zip(offsets[:-1], offsets[1:])]
+    g = np.searchsorted(offsets, e_i, side="right") - 1
+    i = e_i - offsets[g]
+    e = hulls[g][i]
+
+    ch_i = [e_i]
+    for _ in range(m):
+        progress.update(len(ch_i))
+        p = hulls[g][i]
+        next_q, next_d = None, 0
+        for h, hull in enumerate(hulls):
+            size = len(hull)
+            if h == g:
+                js = [(i + 1) % size]  # Next point of own group hull
+            else:
+                j = chan_tangent(hull, p) if size > 2 else None
+                js = range(size) if j is None else [(j - 1) % size, j, (j + 1) % size]  # All if not found
+
+            for j in js:
+                q = hull[j]
+                d = (q[0] - p[0])**2 + (q[1] - p[1])**2
+                if d == 0:
+                    continue  # Ignore duplicates of last point
+                u = 0 if next_q is None else cm.area_triangle(next_q, p, q)
+                if next_q is None or u < 0 or (u == 0 and d > next_d):
+                    next_q, next_d, next_g, next_i = q, d, h, j
+
+        if next_q is None or next_q == e:
+            ch_i.append(e_i)  # Connect first and last
+            break
+        g, i = next_g, next_i
+        ch_i.append(offsets[g] + i)
+    return ch_i
+
+
+# Finds position of tangent from point p on group hull (list of at least 3 counter-clockwise points), point where
+# turns from p to group hull points stop going right, returns None if not found (p on group hull)
+def chan_tangent(hull, p):
+    size = len(hull)
+
+    # Turn direction from p to group hull point i to i + 1 (negative if right turn)
+    def turn(i):
+        return cm.area_triangle(hull[i % size], p, hull[(i + 1) % size])
+
+    first_turn = turn(0)
+    if turn(-1) <= 0 <= first_turn:
+        return 0
+
+    # First point is either before tangent (turns going right after it) or after it, tangent is after middle
+    # point if it turns right and is right of first point (going right after first point), or it turns right or
+    # is left of first point (going left after first point)
+    lo, hi = 1, size
+    while lo < hi:
+        c = (lo + hi) // 2
+        c_turn = turn(c)
+        if turn(c - 1) <= 0 <= c_turn:
+            return c
+        left = cm.area_triangle(hull[0], p, hull[c]) > 0
+        if (c_turn < 0 and not left) if first_turn <= 0 else (c_turn < 0 or left):
+            lo = c + 1
+        else:
+            hi = c
+    return None
+
+
+# Finds indexes of candidates for next convex hull point after group hull point (index pi_i, group hull points
+# as float coordinate rows xy), using binary search on each group hull for its tangent from last point (point with
+# whole group hull left of line from last point), takes tangent with its neighbours (for points on the same line),
+# next point of own group hull and all points of group hulls without found tangent (last point on them or less
+# than 3 points)
+def chan_tangents(xy, offsets, pi_i):
+    starts, sizes = offsets[:-1], np.diff(offsets)
+    p = xy[:, pi_i]
+    own = np.searchsorted(offsets, pi_i, side="right") - 1
+
+    # Turn directions from last point to group hull point i to i + 1 of groups s (negative if right turn)
+    def turns(s, i):
+        return cm.area_triangle(xy[:, starts[s] + i % sizes[s]], p, xy[:, starts[s] + (i + 1) % sizes[s]])
+
+    # Same binary search as chan_tangent() on all groups at once
+    tangents = np.full(len(sizes), -1)
+    s = np.flatnonzero(sizes > 2)
+    s = s[s != own]
+    first_turns = turns(s, 0)
+    found = (turns(s, -1) <= 0) & (first_turns >= 0)
+    tangents[s[found]] = 0
+    right_first = np.zeros(len(sizes), dtype=bool)
+    right_first[s] = first_turns <= 0
+    lo, hi = np.ones(len(sizes), dtype=int), sizes.copy()
+    s = s[~found]
+
+    while len(s) > 0:
+        c = (lo[s] + hi[s]) // 2
+        c_turns = turns(s, c)
+        found = (turns(s, c - 1) <= 0) & (c_turns >= 0)
+        tangents[s[found]] = c[found]
+
+        left = cm.area_triangle(xy[:, starts[s]], p, xy[:, starts[s] + c]) > 0
+        after = np.where(right_first[s], (c_turns < 0) & ~left, (c_turns < 0) | left)
+        lo[s] = np.where(after, c + 1, lo[s])
+        hi[s] = np.where(after, hi[s], c)
+        s = s[~found & (lo[s] < hi[s])]
+
+    s = np.flatnonzero(tangents >= 0)
+    neighbours = (tangents[s, np.newaxis] + [-1, 0, 1]) % sizes[s, np.newaxis]
+    missing = tangents < 0
+    missing[own] = False
+    own_next = starts[own] + (pi_i - starts[own] + 1) % sizes[own]
+    return np.concatenate(((starts[s, np.newaxis] + neighbours).ravel(), [own_next],
+                           np.flatnonzero(np.repeat(missing, sizes))))
+
+
+# Convex hull kept up to date while points are inserted and deleted, as lower and upper chain in the same order
+# as Monotone Chain (upper chain stored with negated coordinates, so both are lower chains sorted by X, then Y),
+# insertion finds place in chain in O(log n) and removes points no longer on chain (amortized O(1) each),
+# deleting point on convex hull marks chains dirty and they are rebuilt using Monotone Chain on next access
+class DynamicConvexHull():
+    def __init__(self, points=()):
+        self.points = {}  # Dictionary of point (tuple) to amount of its duplicates
+        for p in np.asarray(points, dtype=float).reshape(-1, 2).tolist():
+            p = tuple(p)
+            self.points[p] = self.points.get(p, 0) + 1
+        self.lower, self.upper = [], []
+        self.dirty = False  # Chains need rebuild
+        self.rebuilds = 0
+        self.rebuild()
+
+    def __len__(self):
+        return sum(self.points.values())
+
+    def insert(self, p):
+        p = (float(p[0]), float(p[1]))
+        self.points[p] = self.points.get(p, 0) + 1
+        if self.points[p] > 1 or self.dirty:
+            return  # Duplicate (already considered) or chains will be rebuilt anyway
+
+        dynamic_chain_insert(self.lower, p)
+        dynamic_chain_insert(self.upper, (-p[0], -p[1]))
+
+    def delete(self, p):
+        p = (float(p[0]), float(p[1]))
+        if p not in self.points:
+            raise ValueError("Point {} not in convex hull points".format(p))
+
+        self.points[p] -= 1
+        if self.points[p] > 0:
+            return  # Duplicate still present
+        del self.points[p]
+
+        # Rebuild chains (lazily) only if deleted point was on convex hull
+        if not self.dirty and (dynamic_chain_contains(self.lower, p) or
+                               dynamic_chain_contains(self.upper, (-p[0], -p[1]))):
+            self.dirty = True
+
+    # Returns convex hull points (counter-clockwise, first point repeated at end)
+    def hull(self):
+        if self.dirty:
+            self.rebuild()
+
+        if len(self.lower) == 0:
+            return np.empty((0, 2))
+
+        ch = self.lower[:-1] + [(-x, -y) for x, y in self.upper[:-1]]  # Last point of each is first of the other
+        if len(ch) == 0:
+            ch = self.lower  # Single point
+        return np.array(ch + [ch[0]])  # Connect first and last
+
+    def rebuild(self):
+        ps = sorted(self.points)
+        self.lower = [ps[i] for i in monotone_chain_pass(ps)]
+        self.upper = [(-ps[-1 - i][0], -ps[-1 - i][1]) for i in monotone_chain_pass(reversed(ps))]
+        self.dirty = False
+        self.rebuilds += 1
+
+
+# Inserts point into lower chain (points sorted by X, then Y, forming only left turns) if it lies below it
+def dynamic_chain_insert(chain, p):
+    i = bisect.bisect_left(chain, p)
+    if 0 < i < len(chain) and cm.area_triangle(chain[i], chain[i - 1], p) >= 0:
+        return  # On or above line between neighbours, not part of chain
+
+    # Remove neighbours no longer forming left turn with point
+    while i > 1 and cm.area_triangle(chain[i - 1], chain[i - 2], p) <= 0:
+        del chain[i - 1]
+        i -= 1
+    while i < len(chain) - 1 and cm.area_triangle(chain[i], p, chain[i + 1]) <= 0:
+        del chain[i]
+
+    chain.insert(i, p)
+
+
+# Checks if point is part of chain
+def dynamic_chain_contains(chain, p):
+    i = bisect.bisect_left(chain, p)
+    return i < len(chain) and chain[i] == p
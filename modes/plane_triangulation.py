@@ -1,111 +1,407 @@
 #!/usr/bin/env python3
 
 import numpy as np
-
+import warnings
+from time import perf_counter_ns
+
+import cache
+import common as cm
+import profiler
+import progress
+from spatial import SegmentGrid, PointGrid
 from modes import points_lines as pl
 from modes import convex_hulls as ch
 
 
 class PlaneTriangulation():
-    def __init__(self, parent):
-        self.parent = parent
-        self.algorithm = 0  # 0 - Minimum-Weight Triangulation, 1 - Hamiltonian Path
-        self.points = np.array([])
+    def __init__(self, parent=None):
+        self.parent = parent  # Object with log(text) method (main window, common.Log) or None
+        self.algorithm = 0  # 0 - Minimum-Weight Triangulation, 1 - Hamiltonian Path, 2 - Delaunay
+        self.neighbours = None  # Limit Minimum-Weight Triangulation lines to k nearest neighbours (None - all)
+        self.points = np.empty((0, 2))
+        self.digest = None  # Hash of points for result cache (calculated when first needed)
 
     def set_algorithm(self, algorithm):
         self.algorithm = algorithm
 
+    def set_neighbours(self, neighbours):
+        self.neighbours = neighbours
+
     def set_points(self, points):
-        self.points = np.array(points, dtype=float)
+        self.points = cm.as_points(points)  # No copy of float32 and float64 arrays (memory maps stay on disk)
+        self.digest = None
 
     def calculate(self):
+        neighbours = self.neighbours if self.algorithm == 0 else None  # Only Minimum-Weight uses neighbours
+        return cache.cached_mode(self, self.points, ("plane triangulation", self.algorithm, neighbours),
+                                 self.calculate_uncached)
+
+    def calculate_uncached(self):
         if self.algorithm == 0:
-            return mwt(self.points), (np.array([]), np.array([]))
+            return mwt(self.points, k=self.neighbours, main=self.parent), (np.array([]), np.array([]))
         elif self.algorithm == 1:
             return np.array([]), hamiltonian_path(self.points, main=self.parent)
+        elif self.algorithm == 2:
+            triangles = delaunay(self.points, main=self.parent)
+            return self.points[triangle_edges(triangles)], (np.array([]), np.array([]))
 
 
-def mwt(points):
-    if len(points) < 2:
+@profiler.profiled("Minimum-Weight triangulation")
+def mwt(points, k=None, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
+
+    if amount < 2:
         return np.array([])
 
-    # Generate convex hull (for algorithm end check)
-    ch_points = len(ch.quickhull(points)) - 1  # -1 from final connection
-
-    # Generate all possible lines
-    lines = []
-    distances = []
-    for i, p1 in enumerate(points):
-        for p2 in points[i + 1:]:
-            lines.append([p1, p2])
-            distances.append(pl.euclidean_dist(p1, p2))
-
-    # Sort lines by distance (shortest to longest)
-    lines = np.array(lines)
-    distances = np.array(distances)
-    lines = lines[distances.argsort()]
-
-    # Shortest line is definitely part of triangulation
-    pt_lines = [lines[0]]
-    lines = lines[1:]
-
-    # Accept lines that don't intersect already accepted lines, reject others
-    # Repeat until enough lines are accepted (3 * points - 3 - convex hull points)
-    while len(pt_lines) < 3 * len(points) - 3 - ch_points:
-        line = lines[0]
-
-        intersection = False
-        for pt_line in pt_lines:
-            pi, itype = pl.intersection(line[0], line[1], pt_line[0], pt_line[1])
-            if itype == "intersection":
-                intersection = True
+    # Generate convex hull (for algorithm end check), shared with Quickhull of convex hulls mode in result cache
+    ch_points = len(cache.cached(("convex hull", 2, False), points, ch.quickhull)) - 1  # -1 from final connection
+
+    # Generate all possible lines (or only lines to k nearest neighbours)
+    with profiler.span("Generate lines"):
+        lines_a, lines_b, distances = mwt_lines(points, k=k)
+        profiler.count("lines", len(distances))
+        profiler.count("bytes", lines_a.nbytes + lines_b.nbytes + distances.nbytes)
+
+    with profiler.span("Accept lines"):
+        # Index accepted lines, so only lines close to new line need to be checked for intersection
+        grid = SegmentGrid(points)
+        pt_lines = np.empty((max(3 * amount - 3 - ch_points, 0), 2), dtype=int)  # Accepted lines as point index pairs
+        accepted = 0
+        tests, pruned = 0, 0
+
+        # Accept lines (shortest to longest) that don't intersect already accepted lines, reject others
+        # Repeat until enough lines are accepted (3 * points - 3 - convex hull points) or out of lines
+        for a, b in mwt_sorted(lines_a, lines_b, distances):
+            if accepted >= len(pt_lines):
+                break
+            progress.update(accepted, len(pt_lines))
+
+            # Check accepted lines near line cell by cell, stop at first intersection
+            line = points[[a, b]]
+            checked = 0
+            for near in grid.query_cells(line[0], line[1]):
+                checked += len(near)
+                if pl.any_intersection(line, points[pt_lines[near]]):
+                    break
+            else:
+                near = None
+            tests += checked
+            pruned += accepted - checked
+
+            if near is None:
+                pt_lines[accepted] = a, b
+                accepted += 1
+                grid.insert(line[0], line[1])
+
+        profiler.count("accepted", accepted)
+        profiler.count("intersection tests", tests)
+        profiler.count("pruned", pruned)
+
+    # Lines to k nearest neighbours can run out before triangulation is complete
+    if k is not None and accepted < len(pt_lines):
+        profiler.count("missing lines", len(pt_lines) - accepted)
+        warnings.warn("Minimum-Weight triangulation is incomplete, accepted {} of {} lines from {} nearest neighbours"
+                      .format(accepted, len(pt_lines), k))
+
+    return points[pt_lines[:accepted]]
+
+
+# Generates lines between all pairs of points (or only to k nearest neighbours of each point),
+# returns lines as point index pairs (2 arrays) and their lengths
+def mwt_lines(points, k=None):
+    amount = len(points)
+
+    if k is None or k >= amount - 1:
+        count = amount * (amount - 1) // 2
+        lines_a = np.empty(count, dtype=np.int32)
+        lines_b = np.empty(count, dtype=np.int32)
+        distances = np.empty(count, dtype=np.float32)
+
+        pos = 0
+        for i in range(amount - 1):
+            progress.update(pos, count)
+            v = points[(i + 1):] - points[i]
+            lines_a[pos:(pos + len(v))] = i
+            lines_b[pos:(pos + len(v))] = np.arange(i + 1, amount)
+            distances[pos:(pos + len(v))] = np.hypot(v[:, 0], v[:, 1])
+            pos += len(v)
+
+        return lines_a, lines_b, distances
+
+    # Find k nearest neighbours of each point in grid of points
+    ids = np.repeat(np.arange(amount), k + 1)
+    nearest = PointGrid(points).nearest_k(points, k + 1)[0].ravel()  # Including point itself
+    other = ids != nearest
+    ids, nearest = ids[other], nearest[other]
+
+    # Remove lines found from both of its points
+    codes = np.unique(np.minimum(ids, nearest) * amount + np.maximum(ids, nearest))
+    lines_a = (codes // amount).astype(np.int32)
+    lines_b = (codes % amount).astype(np.int32)
+    v = points[lines_b] - points[lines_a]
+    distances = np.hypot(v[:, 0], v[:, 1]).astype(np.float32)
+
+    return lines_a, lines_b, distances
+
+
+# Yields lines (point index pairs) sorted by length (equal lengths by point indexes), moving the next (growing, up to
+# 2^18 lines) chunk of shortest lines to front of lines not yet yielded, arrays are reordered in place (temporary
+# memory is a mask of remaining lines and chunk indexes), length limit of chunk is estimated from a sample of lines
+def mwt_sorted(lines_a, lines_b, distances, chunk=1024, sample=65536):
+    amount = len(distances)
+    pos = 0
+    while pos < amount:
+        rest = distances[pos:]
+        if len(rest) > chunk:
+            step = max(1, len(rest) // sample)
+            ids = np.partition(rest[::step], chunk // step)  # Copy of sample only
+            ids = np.flatnonzero(rest <= ids[chunk // step])
+        else:
+            ids = np.arange(len(rest))
+
+        # Swap chunk lines behind chunk with not chunk lines in its place
+        count = len(ids)
+        front = np.zeros(count, dtype=bool)
+        front[ids[ids < count]] = True
+        outside, inside = pos + ids[ids >= count], pos + np.flatnonzero(~front)
+        for array in (lines_a, lines_b, distances):
+            array[outside], array[inside] = array[inside], array[outside]
+
+        end = pos + count
+        order = pos + np.lexsort((lines_b[pos:end], lines_a[pos:end], distances[pos:end]))
+        for i in range(0, count, sample):
+            yield from zip(lines_a[order[i:(i + sample)]].tolist(), lines_b[order[i:(i + sample)]].tolist())
+
+        pos = end
+        chunk = min(chunk * 2, 2**18)
+
+
+GHOST = -1  # Vertex at infinity, ghost triangles (a, b, GHOST) cover half-plane left of line a-b outside of convex hull
+
+
+# Randomized incremental (Bowyer-Watson) Delaunay triangulation, returns triangles as point index triples
+@profiler.profiled("Delaunay triangulation")
+def delaunay(points, main=None):
+    amount = len(points)
+    profiler.count("points", amount)
+    if amount < 3:
+        profiler.count("triangles", 0)
+        return np.empty((0, 3), dtype=int)
+
+    with profiler.span("Order points for insertion"):
+        # Insertion order (random rounds, each sorted along rows, so walks from last inserted point are short)
+        order = delaunay_order(points)
+        ps = list(zip(points[:, 0].tolist(), points[:, 1].tolist()))
+
+        # Find first triangle (first 3 points not on the same line)
+        first = [order[0]]
+        for i in order[1:]:
+            if len(first) == 1 and ps[i] != ps[first[0]]:
+                first.append(i)
+            elif len(first) == 2 and cm.area_triangle(ps[first[1]], ps[first[0]], ps[i]) != 0:
+                first.append(i)
                 break
 
-        if not intersection:
-            pt_lines.append(line)
-
-        lines = lines[1:]
-
-    return np.array(pt_lines)
-
-
+    if len(first) < 3:
+        profiler.count("triangles", 0)
+        return np.empty((0, 3), dtype=int)
+
+    a, b, c = first
+    if cm.area_triangle(ps[b], ps[a], ps[c]) < 0:
+        a, b = b, a  # Counter-clockwise
+
+    # Triangle vertexes, neighbours (neighbour i is opposite of vertex i) and whether triangle is still part of
+    # triangulation, first triangle and its 3 ghost triangles
+    tv = [[a, b, c], [b, a, GHOST], [c, b, GHOST], [a, c, GHOST]]
+    tn = [[2, 3, 1], [3, 2, 0], [1, 3, 0], [2, 1, 0]]
+    alive = [True] * 4
+
+    # Phases are interleaved per point, measure them only when profiling
+    timing = profiler.enabled()
+    time_locate, time_cavity, time_create = 0, 0, 0
+    walks, conflicts, duplicates = 0, 0, 0
+    last = 0
+    for done, p in enumerate(order):
+        progress.update(done, amount)
+        if p == a or p == b or p == c:
+            continue
+        pp = ps[p]
+
+        if timing:
+            start_locate = perf_counter_ns()
+
+        # Walk from last created triangle towards point
+        t = last
+        while tv[t][2] != GHOST:
+            v0, v1, v2 = tv[t]
+            if cm.area_triangle(ps[v2], ps[v1], pp) < 0:
+                t = tn[t][0]
+            elif cm.area_triangle(ps[v0], ps[v2], pp) < 0:
+                t = tn[t][1]
+            elif cm.area_triangle(ps[v1], ps[v0], pp) < 0:
+                t = tn[t][2]
+            else:
+                break
+            walks += 1
+
+        if timing:
+            end_locate = perf_counter_ns()
+            time_locate += end_locate - start_locate
+
+        if tv[t][2] != GHOST and pp in (ps[tv[t][0]], ps[tv[t][1]], ps[tv[t][2]]):
+            duplicates += 1
+            continue  # Duplicate point
+
+        # Find all triangles whose circumcircle contains point (cavity) and edges around them
+        cavity = {t}
+        stack = [t]
+        edges = []  # List of (edge start, edge end, neighbour outside cavity, index of edge in neighbour)
+        while stack:
+            s = stack.pop()
+            for i in range(3):
+                n = tn[s][i]
+                if n in cavity:
+                    continue
+                conflicts += 1
+                if delaunay_conflict(ps, tv[n], pp):
+                    cavity.add(n)
+                    stack.append(n)
+                else:
+                    edges.append((tv[s][(i + 1) % 3], tv[s][(i + 2) % 3], n, tn[n].index(s)))
+
+        if timing:
+            end_cavity = perf_counter_ns()
+            time_cavity += end_cavity - end_locate
+
+        # Connect point with all edges around cavity
+        for s in cavity:
+            alive[s] = False
+        ends = {}  # Dictionary of cavity edge end to new triangle on that edge
+        for u, v, n, ni in edges:
+            t = len(tv)
+            if u == GHOST:
+                tv.append([v, p, GHOST])
+                tn.append([-1, n, -1])
+            elif v == GHOST:
+                tv.append([p, u, GHOST])
+                tn.append([n, -1, -1])
+            else:
+                tv.append([u, v, p])
+                tn.append([-1, -1, n])
+                last = t
+            alive.append(True)
+            tn[n][ni] = t
+            ends[v] = t
+
+        # Link new triangles with each other (across edges going through point)
+        for t in range(len(tv) - len(edges), len(tv)):
+            tp = tv[t].index(p)
+            u = tv[t][(tp + 1) % 3]  # Vertex after point (start of cavity edge)
+            o = ends[u]  # New triangle on cavity edge ending in u, sharing edge point-u
+            tn[t][(tp + 2) % 3] = o
+            tn[o][(tv[o].index(p) + 1) % 3] = t
+
+        if timing:
+            time_create += perf_counter_ns() - end_cavity
+
+    triangles = np.array([v for v, al in zip(tv, alive) if al and v[2] != GHOST], dtype=int)
+
+    if timing:
+        profiler.add("Locate inserted points", time_locate, {"walk steps": walks})
+        profiler.add("Find conflicting triangles (legalization)", time_cavity, {"circle tests": conflicts})
+        profiler.add("Insert new triangles", time_create)
+    profiler.count("duplicates", duplicates)
+    profiler.count("triangles", len(triangles))
+
+    return triangles
+
+
+# Checks if point lies in circumcircle of triangle (or in half-plane of ghost triangle, or on its hull line)
+def delaunay_conflict(ps, v, p):
+    if v[2] != GHOST:
+        return cm.in_circle(ps[v[0]], ps[v[1]], ps[v[2]], p) > 0
+
+    a, b = ps[v[0]], ps[v[1]]
+    u = cm.area_triangle(b, a, p)
+    if u != 0:
+        return u > 0
+
+    # On line, conflict only if between hull points
+    return (p[0] - a[0]) * (b[0] - a[0]) + (p[1] - a[1]) * (b[1] - a[1]) > 0 and \
+        (p[0] - b[0]) * (a[0] - b[0]) + (p[1] - b[1]) * (a[1] - b[1]) > 0
+
+
+# Orders points for insertion into Delaunay triangulation (biased randomized insertion order)
+def delaunay_order(points):
+    amount = len(points)
+    order = np.random.RandomState(0).permutation(amount)  # Fixed seed for reproducible timings
+
+    # Split into rounds doubling in size, sort each round in snake order of rows
+    low, high = points.min(axis=0), points.max(axis=0)
+    size = np.where(high > low, high - low, 1)
+    rounds = []
+    end = amount
+    while end > 0:
+        start = end // 2 if end > 64 else 0
+        ids = order[start:end]
+        rows = max(1, int(np.sqrt(len(ids) / 2)))
+        row = np.minimum(((points[ids, 1] - low[1]) / size[1] * rows).astype(int), rows - 1)
+        x = np.where(row % 2 == 0, points[ids, 0], -points[ids, 0])
+        rounds.append(ids[np.lexsort((x, row))])
+        end = start
+
+    return np.concatenate(rounds[::-1]).tolist()
+
+
+# Returns unique edges (point index pairs) of triangles
+def triangle_edges(triangles):
+    if len(triangles) == 0:
+        return np.empty((0, 2), dtype=int)
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+@profiler.profiled("Hamiltonian path triangulation")
 def hamiltonian_path(points, main=None):
-    # Generate convex hulls and spiral list
-    ch_points = []
-    s_points = []
-    while len(points) > 0:
-        # Generate convex hull (without last connecting point)
-        ch_p = ch.quickhull(points)[:-1]
-
-        # Find max Y and roll hull around to have max Y as first element
-        ch_max_i = np.lexsort((ch_p[:, 0], ch_p[:, 1]))[-1]  # Max Y point's index
-        ch_p = np.roll(ch_p, -ch_max_i, axis=0)
-
-        # Assure first point in inner hull forms convex angle
-        if len(s_points) > 0 and len(ch_p) > 1:
-            # Roll until convex angle (one roll might not be enough)
-            angle = -1
-            while angle < 0:
-                a = s_points[-1] - ch_p[0]  # Vector from last point of outer hull to first point in inner hull
-                b = ch_p[0] - ch_p[1]  # Vector from first point to second point in inner hull
-                angle = np.arctan2(a[0] * b[1] - a[1] * b[0], a[0] * b[0] + a[1] * b[1])  # Angle between above vectors
-
-                # Roll by one so wanted point becomes first
-                if angle < 0:
-                    ch_p = np.roll(ch_p, -1, axis=0)
-
-                    # if main is not None:
-                    #     main.plot_point(ch_p[-1], text="O")  # Debug
-                    #     main.plot_point(ch_p[0], text="R")  # Debug
-
-        # Assure spiral doesn't intersect itself
-        if len(ch_points) > 0:
-            ch_last = ch_points[-1]
-            first, last, inner = ch_last[0], ch_last[-1], ch_p[0]
-
-            for i, p in enumerate(ch_p[:-1]):
-                pi, itype = pl.intersection(last, inner, p, ch_p[i + 1])
-                if itype == "intersection":
+    profiler.count("points", len(points))
+
+    with profiler.span("Generate spiral"):
+        # Generate convex hulls and spiral list
+        _, layers = ch.convex_layers(points, main=main)
+        ch_points = []
+        s_points = []
+        for layer in layers:
+            ch_p = points[layer]
+
+            # Find max Y and roll hull around to have max Y as first element
+            ch_max_i = np.lexsort((ch_p[:, 0], ch_p[:, 1]))[-1]  # Max Y point's index
+            ch_p = np.roll(ch_p, -ch_max_i, axis=0)
+
+            # Assure first point in inner hull forms convex angle
+            if len(s_points) > 0 and len(ch_p) > 1:
+                # Roll until convex angle (one roll might not be enough)
+                angle = -1
+                while angle < 0:
+                    a = s_points[-1] - ch_p[0]  # Vector from last point of outer hull to first point in inner hull
+                    b = ch_p[0] - ch_p[1]  # Vector from first point to second point in inner hull
+                    # Angle between above vectors
+                    angle = np.arctan2(a[0] * b[1] - a[1] * b[0], a[0] * b[0] + a[1] * b[1])
+
+                    # Roll by one so wanted point becomes first
+                    if angle < 0:
+                        ch_p = np.roll(ch_p, -1, axis=0)
+
+                        # if main is not None:
+                        #     main.plot_point(ch_p[-1], text="O")  # Debug
+                        #     main.plot_point(ch_p[0], text="R")  # Debug
+
+            # Assure spiral doesn't intersect itself
+            if len(ch_points) > 0:
+                ch_last = ch_points[-1]
+                first, last, inner = ch_last[0], ch_last[-1], ch_p[0]
+
+                if pl.any_intersection(np.array([last, inner]), np.stack((ch_p[:-1], ch_p[1:]), axis=1)):
                     # Insert point high enough between first and last point of outer hull
                     offset_factor = (inner[1] - last[1]) / (first[1] - last[1])
                     x_offset = (last[0] - first[0]) * offset_factor
@@ -120,55 +416,60 @@ def hamiltonian_path(points, main=None):
                     #     main.plot_point(last, color="red", text="I")  # Debug
                     #     main.plot_point(new_p, color="red", text="O")  # Debug
 
-                    break
-
-        # Add to forming spiral and hulls list
-        s_points.extend(ch_p)
-        ch_points.append(ch_p)
+            # Add to forming spiral and hulls list
+            s_points.extend(ch_p)
+            ch_points.append(ch_p)
 
-        # Remove convex hull points from left-over points
-        points = np.array([p for p in points if p not in ch_p])
+        profiler.count("spiral points", len(s_points))
 
     # Exit if not enough convex hulls for triangulation
     if len(ch_points) < 2:
         return np.array(s_points), np.array([])
 
-    # Generate generalized triangle strip
-    # Indexes of last point in first hull, first points in second and first hulls
-    a, b, c = len(ch_points[0]) - 1, len(ch_points[0]), 0
-    pt_points = [s_points[a], s_points[b], s_points[c]]
+    with profiler.span("Generate triangle strip"):
+        # Generate generalized triangle strip
+        # Indexes of last point in first hull, first points in second and first hulls
+        a, b, c = len(ch_points[0]) - 1, len(ch_points[0]), 0
+        pt_points = [s_points[a], s_points[b], s_points[c]]
+
+        # Index spiral and strip lines, so only lines close to new line need to be checked for intersection
+        grid = SegmentGrid(points)
+        grid_lines = []
+        for line in zip(s_points[:-1], s_points[1:]):
+            grid.insert(line[0], line[1])
+            grid_lines.append(line)
+        for line in zip(pt_points[:-1], pt_points[1:]):
+            grid.insert(line[0], line[1])
+            grid_lines.append(line)
+        tests, pruned = 0, 0
+
+        # Walk path until last 2 indexes are one apart
+        while b - 1 != c:
+            progress.update(c, len(s_points))
+            # Move to next triangle
+            a, b = b, c
+            c = a + 1
+
+            # Degenerate on final point
+            if c >= len(s_points):
+                c = a  # Swap to valid index (degenerate)
+            else:
+                # Check if new line intersects spiral list or already created lines
+                line = np.array([pt_points[-1], s_points[c]])
+                near = grid.query(line[0], line[1])
+                tests += len(near)
+                pruned += len(grid_lines) - len(near)
+
+                # Degenerate on intersection
+                if near and pl.any_intersection(line, np.array([grid_lines[i] for i in near])):
+                    c = a  # Swap to valid index (degenerate)
 
-    # Walk path until last 2 indexes are one apart
-    while b - 1 != c:
-        # Move to next triangle
-        a, b = b, c
-        c = a + 1
-
-        # Degenerate on final point
-        if c >= len(s_points):
-            c = a  # Swap to valid index (degenerate)
             pt_points.append(s_points[c])
-            continue
-
-        # Check if new line intersects spiral list or already created lines
-        line = [pt_points[-1], s_points[c]]
-        intersection = False
-        for i, p in enumerate(s_points[:-1]):
-            pi, itype = pl.intersection(line[0], line[1], p, s_points[i + 1])
-            if itype == "intersection":
-                intersection = True
-                break
-        if not intersection:
-            for i, p in enumerate(pt_points[:-1]):
-                pi, itype = pl.intersection(line[0], line[1], p, pt_points[i + 1])
-                if itype == "intersection":
-                    intersection = True
-                    break
-
-        # Degenerate on intersection
-        if intersection:
-            c = a  # Swap to valid index (degenerate)
+            grid.insert(pt_points[-2], pt_points[-1])
+            grid_lines.append((pt_points[-2], pt_points[-1]))
 
-        pt_points.append(s_points[c])
+        profiler.count("strip points", len(pt_points))
+        profiler.count("intersection tests", tests)
+        profiler.count("pruned", pruned)
 
     return np.array(s_points), np.array(pt_points)
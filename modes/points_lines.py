@@ -136,12 +136,25 @@ def intersection(p1, p2, p3, p4):
     b = cm.area_rectangle(p2, p1, p1, p3)
 
     if cm.almost_equal(d, 0):
-        # Lines coincide
-        if cm.almost_equal(cm.almost_equal(a, b), 0):
-            return None, "coincident"
-
         # Lines are parallel
-        return None, "parallel"
+        if not cm.almost_equal(a, 0) or not cm.almost_equal(b, 0):
+            return None, "parallel"
+
+        # Lines are on the same line, coincide if they overlap along it, touch if only in one end point
+        v = p2 - p1 if np.dot(p2 - p1, p2 - p1) >= np.dot(p4 - p3, p4 - p3) else p4 - p3  # Direction of line
+        length = np.linalg.norm(v)
+        if length == 0:
+            return (np.array(p1, dtype=float), "touch") if euclidean_dist(p1, p3) < cm.EPSILON else (None, "none")
+
+        s = [np.dot(p - p1, v) / length for p in (p1, p2, p3, p4)]  # Positions of end points along line
+        lo = max(min(s[0], s[1]), min(s[2], s[3]))
+        hi = min(max(s[0], s[1]), max(s[2], s[3]))
+
+        if cm.almost_equal(hi, lo):
+            return np.array((p1, p2, p3, p4)[s.index(lo)], dtype=float), "touch"
+        if hi < lo:
+            return None, "none"
+        return None, "coincident"
 
     ua = a / d
     ub = b / d
@@ -159,3 +172,173 @@ def intersection(p1, p2, p3, p4):
         return xy, "touch"
     else:
         return xy, "intersection"
+
+
+# Type codes of intersections(), indexes of type names returned by intersection()
+INTERSECTION_TYPES = ("none", "parallel", "coincident", "touch", "intersection")
+ITYPE_NONE, ITYPE_PARALLEL, ITYPE_COINCIDENT, ITYPE_TOUCH, ITYPE_INTERSECTION = range(5)
+
+
+# Vectorized intersection() of one line (shape (2, 2)) or M lines (shape (M, 2, 2)) with M lines (shape (M, 2, 2)),
+# returns intersection points (NaN where lines do not touch) and type codes (indexes into INTERSECTION_TYPES)
+def intersections(lines1, lines2):
+    lines1 = np.asarray(lines1, dtype=float)
+    lines2 = np.asarray(lines2, dtype=float)
+
+    # Move coordinates to first axis, so p[0] and p[1] are X and Y of all lines
+    p1, p2 = np.moveaxis(lines1[..., 0, :], -1, 0), np.moveaxis(lines1[..., 1, :], -1, 0)
+    p3, p4 = np.moveaxis(lines2[..., 0, :], -1, 0), np.moveaxis(lines2[..., 1, :], -1, 0)
+
+    d = cm.area_rectangle(p2, p1, p4, p3)
+    a = cm.area_rectangle(p4, p3, p1, p3)
+    b = cm.area_rectangle(p2, p1, p1, p3)
+    d, a, b = np.broadcast_arrays(d, a, b)
+
+    itypes = np.full(d.shape, ITYPE_NONE, dtype=np.int8)
+
+    # Lines are parallel or on the same line
+    flat = cm.almost_equal(d, 0)
+    itypes[flat] = ITYPE_PARALLEL
+    same = flat & cm.almost_equal(a, 0) & cm.almost_equal(b, 0)
+
+    # Lines touch or intersect, calculate touching point
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ua = a / d
+        ub = b / d
+        xy = np.stack((p1[0] + ua * (p2[0] - p1[0]), p1[1] + ua * (p2[1] - p1[1])), axis=-1)
+
+    on = ~flat & (0 <= ua) & (ua <= 1) & (0 <= ub) & (ub <= 1)
+    xy[~on] = np.nan
+
+    itypes[on] = ITYPE_INTERSECTION
+    end = cm.almost_equal(ua, 0) | cm.almost_equal(ua, 1) | cm.almost_equal(ub, 0) | cm.almost_equal(ub, 1)
+    itypes[on & end] = ITYPE_TOUCH
+
+    # Lines on the same line coincide if they overlap along it, touch if only in one end point (same as intersection())
+    p1, p2, p3, p4 = [np.stack(np.broadcast_arrays(p[0], p[1], d)[:2]) for p in (p1, p2, p3, p4)]  # X, Y like d
+    v1, v2 = p2 - p1, p4 - p3
+    v = np.where(v1[0]**2 + v1[1]**2 >= v2[0]**2 + v2[1]**2, v1, v2)  # Direction of line
+    length = np.sqrt(v[0]**2 + v[1]**2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s1, s2, s3, s4 = [((p[0] - p1[0]) * v[0] + (p[1] - p1[1]) * v[1]) / length for p in (p1, p2, p3, p4)]
+    lo = np.maximum(np.minimum(s1, s2), np.minimum(s3, s4))
+    hi = np.minimum(np.maximum(s1, s2), np.maximum(s3, s4))
+    point = length == 0  # Both lines are points
+    lo[point], hi[point] = 0, -np.hypot(p1[0] - p3[0], p1[1] - p3[1])[point]
+
+    touch = same & cm.almost_equal(hi, lo)
+    itypes[same] = ITYPE_NONE
+    itypes[same & (hi > lo)] = ITYPE_COINCIDENT
+    itypes[touch] = ITYPE_TOUCH
+    ends = np.select([lo == s1, lo == s2, lo == s3], [p1, p2, p3], p4)  # End point starting overlap
+    xy[touch] = np.moveaxis(ends, 0, -1)[touch]
+
+    return xy, itypes
+
+
+# Checks if line (shape (2, 2)) intersects any of lines (shape (M, 2, 2)), checking them in chunks, only crossings in
+# one point count (same as ITYPE_INTERSECTION of intersections()), so lines on the same line (coincident or touching)
+# are skipped without checking their overlap, few lines are checked one by one (cheaper than array operations)
+def any_intersection(line, lines, chunk=256, few=48):
+    lines = np.asarray(lines, dtype=float).reshape(-1, 2, 2)
+    if len(lines) < few:
+        (x1, y1), (x2, y2) = np.asarray(line, dtype=float).tolist()
+        for (x3, y3), (x4, y4) in lines.tolist():
+            d = (x2 - x1) * (y4 - y3) - (y2 - y1) * (x4 - x3)
+            if abs(d) < cm.EPSILON:
+                continue  # Parallel or on the same line
+            ua = ((x4 - x3) * (y1 - y3) - (y4 - y3) * (x1 - x3)) / d
+            ub = ((x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)) / d
+            if 0 <= ua <= 1 and 0 <= ub <= 1 and cm.EPSILON <= min(abs(ua), abs(ua - 1), abs(ub), abs(ub - 1)):
+                return True
+        return False
+
+    p1, p2 = np.asarray(line, dtype=float)
+    for i in range(0, len(lines), chunk):
+        p3, p4 = lines[i:(i + chunk), 0].T, lines[i:(i + chunk), 1].T
+        d = cm.area_rectangle(p2, p1, p4, p3)
+        cross = ~cm.almost_equal(d, 0)
+        d = np.where(cross, d, 1)
+        ua = cm.area_rectangle(p4, p3, p1, p3) / d
+        ub = cm.area_rectangle(p2, p1, p1, p3) / d
+        on = (0 <= ua) & (ua <= 1) & (0 <= ub) & (ub <= 1)
+        end = cm.almost_equal(ua, 0) | cm.almost_equal(ua, 1) | cm.almost_equal(ub, 0) | cm.almost_equal(ub, 1)
+        if np.any(cross & on & ~end):
+            return True
+    return False
+
+
+# Vectorized euclidean_dist() between all points1 (shape (N, 2)) and points2 (shape (M, 2), points1 if not given),
+# returns distance matrix (shape (N, M)) calculated in blocks of rows (temporary memory bounded by block rows),
+# into out if given (e.g. memory map for matrices larger than memory), distances can differ from euclidean_dist()
+# in the last bit (squares of NumPy scalars are rounded by pow())
+def distance_matrix(points1, points2=None, block=256, out=None):
+    points1 = np.asarray(points1, dtype=float).reshape(-1, 2)
+    points2 = points1 if points2 is None else np.asarray(points2, dtype=float).reshape(-1, 2)
+    if out is None:
+        out = np.empty((len(points1), len(points2)))
+
+    for start in range(0, len(points1), block):
+        dx = points1[start:(start + block), 0][:, np.newaxis] - points2[:, 0]
+        dy = points1[start:(start + block), 1][:, np.newaxis] - points2[:, 1]
+        out[start:(start + block)] = np.sqrt(dx * dx + dy * dy)
+
+    return out
+
+
+# Vectorized orth_projection() of N points (shape (N, 2)) onto nearest of M lines (shape (M, 2, 2)), checking lines
+# for blocks of points (temporary memory bounded by block * M), returns index of nearest line (first of equally near),
+# projection falls on line, projected point, closest distance to line and closest point on line for each point
+# (same as orth_projection() results, distances up to the last bit as with distance_matrix())
+def orth_projections(points, lines, block=256):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    lines = np.asarray(lines, dtype=float).reshape(-1, 2, 2)
+    if len(lines) == 0:
+        raise ValueError("No lines to project points onto")
+
+    p2, p3 = lines[:, 0], lines[:, 1]
+    v1 = p3 - p2  # Vectors P2 to P3
+    length = np.sqrt(dot(v1, v1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vN = np.where(length[:, np.newaxis] > 0, v1 / length[:, np.newaxis], v1)  # Base vectors (new X axes)
+
+    amount = len(points)
+    nearest = np.empty(amount, dtype=int)
+    falls_on = np.empty(amount, dtype=bool)
+    pps = np.empty((amount, 2))
+    distances = np.empty(amount)
+    closests = np.empty((amount, 2))
+
+    for start in range(0, amount, block):
+        p1 = points[start:(start + block), np.newaxis]  # Shape (B, 1, 2) against lines
+        v2 = p1 - p2  # Vectors P2 to P1
+
+        sp = dot(vN, v2)
+        pp = p2 + vN * sp[..., np.newaxis]  # Projected points
+        on = (0 <= sp) & (sp <= length)
+
+        # Distance to projected point if it falls on line, otherwise to closest end point (P2 if equally close)
+        d_pp = np.sqrt(((p1 - pp)**2).sum(axis=-1))
+        d_p2 = np.sqrt(((p1 - p2)**2).sum(axis=-1))
+        d_p3 = np.sqrt(((p1 - p3)**2).sum(axis=-1))
+        to_p3 = ~on & (d_p3 < d_p2)
+        d = np.where(on, d_pp, np.where(to_p3, d_p3, d_p2))
+
+        i = np.argmin(d, axis=1)
+        rows = np.arange(len(i))
+        end = start + len(i)
+        nearest[start:end] = i
+        falls_on[start:end] = on[rows, i]
+        pps[start:end] = pp[rows, i]
+        distances[start:end] = d[rows, i]
+        closests[start:end] = np.where(on[rows, i, np.newaxis], pp[rows, i],
+                                       np.where(to_p3[rows, i, np.newaxis], p3[i], p2[i]))
+
+    return nearest, falls_on, pps, distances, closests
+
+
+# Dot products of vectors along last axis, rounded the same as np.dot() of single vectors (which may use fused
+# multiply-add) unlike multiplying and adding coordinates
+def dot(v1, v2):
+    v1, v2 = np.broadcast_arrays(v1, v2)
+    return np.matmul(v1[..., np.newaxis, :], v2[..., :, np.newaxis])[..., 0, 0]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import heapq
+import numpy as np
+
+import cache
+import common as cm
+import profiler
+import progress
+from modes import points_lines as pl
+
+
+class SegmentIntersections():
+    def __init__(self, parent=None):
+        self.parent = parent  # Object with log(text) method (main window, common.Log) or None
+        self.lines = np.empty((0, 2, 2))
+        self.digest = None  # Hash of lines for result cache (calculated when first needed)
+
+    def set_lines(self, lines):
+        self.lines = np.asarray(lines, dtype=float).reshape(-1, 2, 2)
+        self.digest = None
+
+    def calculate(self):
+        return cache.cached_mode(self, self.lines, ("segment intersections",), self.calculate_uncached)
+
+    def calculate_uncached(self):
+        return bentley_ottmann(self.lines, main=self.parent)
+
+
+# Finds all intersections between lines (shape (N, 2, 2)) with Bentley-Ottmann sweep (vertical sweep line moving
+# from left to right, ties from bottom to top), returns intersection points, pairs of line indexes and type codes
+# (pl.ITYPE_TOUCH, pl.ITYPE_INTERSECTION or pl.ITYPE_COINCIDENT, classified by pl.intersection()),
+# lines meeting in one point are reported as all pairs, overlapping lines at both ends of overlap
+@profiler.profiled("Bentley-Ottmann sweep")
+def bentley_ottmann(lines, main=None):
+    lines = np.asarray(lines, dtype=float).reshape(-1, 2, 2)
+    amount = len(lines)
+    profiler.count("lines", amount)
+
+    # Order line end points, so sweep meets first (left, lower if vertical) point first
+    swap = np.lexsort((lines[:, :, 1], lines[:, :, 0]), axis=1)[:, 0] == 1
+    lines = np.where(swap[:, np.newaxis, np.newaxis], lines[:, ::-1], lines)
+    left, right = lines[:, 0].tolist(), lines[:, 1].tolist()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.where(lines[:, 1, 0] != lines[:, 0, 0], (lines[:, 1, 1] - lines[:, 0, 1]) /
+                          (lines[:, 1, 0] - lines[:, 0, 0]), np.inf).tolist()  # Vertical lines are steepest
+
+    # Event queue of points (X, Y), lines starting and ending at end point events
+    starts, ends = {}, {}
+    for i in range(amount):
+        starts.setdefault(tuple(left[i]), []).append(i)
+        ends.setdefault(tuple(right[i]), []).append(i)
+    queue = list(starts.keys() | ends.keys())
+    heapq.heapify(queue)
+    queued = set(queue)
+
+    # Y of line where it crosses sweep line at event point p (p itself for vertical lines at p)
+    def y_at(i, p):
+        (x1, y1), (x2, y2) = left[i], right[i]
+        if x1 == x2:
+            return min(max(p[1], y1), y2)
+        if p[0] == x1:
+            return y1
+        if p[0] == x2:
+            return y2
+        return y1 + (p[0] - x1) * slopes[i]
+
+    # Index of first line in status at or above Y (status is ordered by Y at sweep line)
+    def search(p, y):
+        lo, hi = 0, len(status)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if y_at(status[mid], p) < y:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Queues intersection of lines right of (or above) event point p
+    def check(i, j, p):
+        xy, itype = pl.intersection(lines[i, 0], lines[i, 1], lines[j, 0], lines[j, 1])
+        if itype == "intersection" or itype == "touch":
+            q = (float(xy[0]), float(xy[1]))
+            if q > p and not (cm.almost_equal(q[0], p[0]) and cm.almost_equal(q[1], p[1])) and q not in queued:
+                heapq.heappush(queue, q)
+                queued.add(q)
+
+    status = []  # Lines crossing sweep line ordered by Y
+    points, pairs, itypes = [], [], []
+    reported = set()  # Pairs of crossing or touching lines (meet at most once)
+    events, done = 0, 0
+
+    while queue:
+        p = heapq.heappop(queue)
+        events += 1
+        upper = starts.get(p, [])
+        lower = ends.get(p, [])
+        done += len(upper)
+        progress.update(done, amount)
+
+        # Lines in status through p (ending at p or containing it) are next to each other
+        lo = search(p, p[1] - cm.EPSILON)
+        hi = lo
+        while hi < len(status) and cm.almost_equal(y_at(status[hi], p), p[1]):
+            hi += 1
+        through = status[lo:hi]
+        del status[lo:hi]
+        for i in lower:
+            if i not in through and i in status:
+                status.remove(i)  # Missed by tolerance (nearly vertical), keep status consistent
+        lo = search(p, p[1])
+
+        # Report all pairs of lines meeting at p (overlapping lines only at their end points)
+        meeting = sorted(set(upper) | set(through) | set(lower))
+        for a in range(len(meeting)):
+            for b in range(a + 1, len(meeting)):
+                i, j = meeting[a], meeting[b]
+                _, itype = pl.intersection(lines[i, 0], lines[i, 1], lines[j, 0], lines[j, 1])
+                if itype == "coincident":
+                    if p not in (tuple(left[i]), tuple(right[i]), tuple(left[j]), tuple(right[j])):
+                        continue
+                elif itype == "intersection" or itype == "touch":
+                    if (i, j) in reported:
+                        continue
+                    reported.add((i, j))
+                else:
+                    continue
+                points.append(p)
+                pairs.append((i, j))
+                itypes.append(pl.INTERSECTION_TYPES.index(itype))
+
+        # Reinsert lines continuing after p ordered by slope (order right of p), check new neighbours
+        ending = set(lower)
+        inserted = sorted((i for i in set(upper) | set(through) if i not in ending), key=lambda i: slopes[i])
+        status[lo:lo] = inserted
+
+        if not inserted:
+            if 0 < lo < len(status):
+                check(status[lo - 1], status[lo], p)
+        else:
+            if lo > 0:
+                check(status[lo - 1], inserted[0], p)
+            if lo + len(inserted) < len(status):
+                check(inserted[-1], status[lo + len(inserted)], p)
+
+    profiler.count("events", events)
+    profiler.count("intersections", len(points))
+
+    return (np.array(points, dtype=float).reshape(-1, 2), np.array(pairs, dtype=int).reshape(-1, 2),
+            np.array(itypes, dtype=np.int8))
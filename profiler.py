@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import json
+import functools
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+active = None  # Profiler algorithms report into, None when profiling is off
+
+
+# Phase timing profiler, collects nested spans (phases) with nanosecond times and counters
+class Profiler():
+    def __init__(self):
+        self.spans = []  # List of spans (dictionaries), in order of opening
+        self.stack = []  # Indexes of open spans
+
+    def span(self, name):
+        return Span(self, name)
+
+    def open(self, name):
+        self.spans.append({
+            "name": name,
+            "start": perf_counter_ns(),
+            "end": None,
+            "depth": len(self.stack),
+            "parent": self.stack[-1] if self.stack else None,
+            "counters": {},
+            "track": 0,
+        })
+        self.stack.append(len(self.spans) - 1)
+
+    def close(self):
+        self.spans[self.stack.pop()]["end"] = perf_counter_ns()
+
+    # Adds closed span of given duration (phase measured in parts, e.g. inside a loop) to open span,
+    # placed right after previous span of the same parent unless start is given, spans running at the same time
+    # (e.g. in other processes, perf_counter_ns() is system-wide) can be put on their own track
+    def add(self, name, duration, counters=None, start=None, track=0):
+        parent = self.stack[-1] if self.stack else None
+        if start is None:
+            siblings = [s for s in self.spans if s["parent"] == parent and s["end"] is not None]
+            if siblings:
+                start = siblings[-1]["end"]
+            elif parent is not None:
+                start = self.spans[parent]["start"]
+            else:
+                start = perf_counter_ns() - duration
+        self.spans.append({
+            "name": name,
+            "start": start,
+            "end": start + duration,
+            "depth": len(self.stack),
+            "parent": parent,
+            "counters": dict(counters or {}),
+            "track": track,
+        })
+
+    # Adds value to counter of open span
+    def count(self, name, value=1):
+        if self.stack:
+            counters = self.spans[self.stack[-1]]["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    def to_dict(self):
+        origin = self.spans[0]["start"] if self.spans else 0
+        return {"spans": [{
+            "name": s["name"],
+            "start_ns": s["start"] - origin,
+            "duration_ns": (s["end"] or perf_counter_ns()) - s["start"],
+            "depth": s["depth"],
+            "parent": s["parent"],
+            "counters": s["counters"],
+            "track": s["track"],
+        } for s in self.spans]}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    # Exports spans as Chrome trace events (chrome://tracing, Perfetto)
+    def to_chrome_trace(self):
+        return json.dumps({
+            "traceEvents": [{
+                "name": s["name"],
+                "ph": "X",
+                "ts": s["start_ns"] / 1000,  # Microseconds
+                "dur": s["duration_ns"] / 1000,
+                "pid": 0,
+                "tid": s["track"],
+                "args": s["counters"],
+            } for s in self.to_dict()["spans"]],
+            "displayTimeUnit": "ns",
+        })
+
+    # Renders spans as log lines, nested phases prefixed with dashes
+    def lines(self):
+        lines = []
+        for s in self.to_dict()["spans"]:
+            text = "{}{} in {:.3f} ms".format("  " * (s["depth"] - 1) + "- " if s["depth"] else "",
+                                              s["name"], s["duration_ns"] / 1000000)
+            if s["counters"]:
+                text += " ({})".format(", ".join("{}: {}".format(k, v) for k, v in s["counters"].items()))
+            lines.append(text)
+        return lines
+
+
+class Span():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.open(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.close()
+        return False
+
+
+# Span doing nothing, used when profiling is off
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+# Activates new profiler for the duration of with block
+@contextmanager
+def profile():
+    global active
+    previous = active
+    active = Profiler()
+    try:
+        yield active
+    finally:
+        active = previous
+
+
+def enabled():
+    return active is not None
+
+
+def span(name):
+    return NULL_SPAN if active is None else active.span(name)
+
+
+def add(name, duration, counters=None, start=None, track=0):
+    if active is not None:
+        active.add(name, duration, counters, start, track)
+
+
+def count(name, value=1):
+    if active is not None:
+        active.count(name, value)
+
+
+# Decorator wrapping function in a span
+def profiled(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+            with active.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
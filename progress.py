@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+active = None  # Task algorithms report progress into, None when calculation is not tracked
+
+
+# Raised from algorithms (at next progress update) when their task is cancelled
+class Cancelled(Exception):
+    pass
+
+
+# Progress and cancellation token of calculation, callback(done, total) is called from calculating thread
+# at most every interval seconds (total is 0 if unknown)
+class Task():
+    def __init__(self, callback=None, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = threading.Event()  # Set from any thread
+        self.last = 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def update(self, done, total):
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+        if self.callback is not None:
+            now = perf_counter()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.callback(done, total)
+
+
+# Tracks given task for the duration of with block (one calculation at a time)
+@contextmanager
+def track(task):
+    global active
+    previous = active
+    active = task
+    try:
+        yield task
+    finally:
+        active = previous
+
+
+# Reports progress of running algorithm loop, raises Cancelled if task was cancelled
+def update(done, total=0):
+    if active is not None:
+        active.update(done, total)
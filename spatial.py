@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import math
+import numpy as np
+
+import common as cm
+
+
+# Uniform grid of line segments, for finding segments near another segment without checking all of them, segments
+# are kept in cells they pass through (not all cells of their bounding box, long diagonal segments cover few cells)
+class SegmentGrid():
+    def __init__(self, points, cells=None):
+        # Cover bounding box of points with roughly one cell per point
+        self.origin = np.min(points, axis=0).tolist()
+        extent = float(np.max(np.max(points, axis=0) - self.origin))
+        cells = cells or max(1, int(np.sqrt(len(points))))
+        self.cell_size = extent / cells if extent > 0 else 1.0
+
+        self.cells = {}  # Dictionary of (cell x, cell y) to list of segment indexes
+        self.boxes = []  # List of segment bounding boxes (min x, min y, max x, max y)
+        self.seen = []  # Last query which found each segment (to not check segments in many cells again)
+        self.queries = 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    # Returns bounding box of segment, enlarged by tolerance to not miss touching segments
+    def bounding_box(self, p1, p2):
+        return (min(p1[0], p2[0]) - cm.EPSILON, min(p1[1], p2[1]) - cm.EPSILON,
+                max(p1[0], p2[0]) + cm.EPSILON, max(p1[1], p2[1]) + cm.EPSILON)
+
+    # Yields all cells passed by segment (or closer than tolerance), column by column from left: cells between Y of
+    # segment at both sides of column
+    def segment_cells(self, p1, p2):
+        ox, oy, size, eps = self.origin[0], self.origin[1], self.cell_size, cm.EPSILON
+        (x1, y1), (x2, y2) = sorted(((float(p1[0]), float(p1[1])), (float(p2[0]), float(p2[1]))))
+        slope = (y2 - y1) / (x2 - x1) if x2 > x1 else 0.0
+
+        ya = y1
+        for x in range(math.floor((x1 - eps - ox) / size), math.floor((x2 + eps - ox) / size) + 1):
+            if x2 > x1:
+                ya = y1 + (min(max(ox + x * size - eps, x1), x2) - x1) * slope
+                yb = y1 + (min(ox + (x + 1) * size + eps, x2) - x1) * slope
+            else:
+                yb = y2
+            low, high = (ya, yb) if ya <= yb else (yb, ya)
+            for y in range(math.floor((low - eps - oy) / size), math.floor((high + eps - oy) / size) + 1):
+                yield x, y
+
+    # Adds segment to grid, returns its index
+    def insert(self, p1, p2):
+        i = len(self.boxes)
+        self.boxes.append(self.bounding_box(p1, p2))
+        self.seen.append(0)
+        for cell in self.segment_cells(p1, p2):
+            self.cells.setdefault(cell, []).append(i)
+        return i
+
+    # Returns indexes of segments (in insertion order) sharing a cell with segment and with bounding box overlapping
+    # bounding box of segment (all segments touching or crossing it)
+    def query(self, p1, p2):
+        return sorted(i for found in self.query_cells(p1, p2) for i in found)
+
+    # Yields indexes of segments found by query() cell by cell (from left end point of segment), each segment once,
+    # so checks can stop at first segment crossing it without gathering all of them
+    def query_cells(self, p1, p2):
+        box = self.bounding_box(p1, p2)
+        self.queries += 1
+        query, seen, boxes = self.queries, self.seen, self.boxes
+        for cell in self.segment_cells(p1, p2):
+            found = []
+            for i in self.cells.get(cell, ()):
+                if seen[i] != query:
+                    seen[i] = query
+                    b = boxes[i]
+                    if b[0] <= box[2] and box[0] <= b[2] and b[1] <= box[3] and box[1] <= b[3]:
+                        found.append(i)
+            if found:
+                yield found
+
+
+# Uniform grid of points stored as arrays (points sorted by cell, offsets of cells), for nearest neighbour, radius and
+# box queries without checking all points, queries of many points at once are vectorized
+class PointGrid():
+    def __init__(self, points, cells=None):
+        self.build(points, cells)
+
+    def build(self, points, cells=None):
+        self.points = np.array(points, dtype=float).reshape(-1, 2)  # Copy, callers may change their points
+        amount = len(self.points)
+
+        # Cover bounding box of points with roughly one cell per point
+        self.origin = np.min(self.points, axis=0) if amount > 0 else np.zeros(2)
+        extent = np.max(self.points, axis=0) - self.origin if amount > 0 else np.zeros(2)
+        cells = cells or max(1, int(np.sqrt(amount)))
+        self.cell_size = float(np.max(extent)) / cells if np.max(extent) > 0 else 1.0
+        self.shape = (np.floor(extent / self.cell_size).astype(int) + 1).tolist()  # Cells in X and Y
+
+        # Sort points by cell, points of cell c are order[offsets[c]:offsets[c + 1]]
+        keys = self.cell_keys(self.cells_of(self.points))
+        self.order = np.argsort(keys, kind="stable")
+        self.offsets = np.searchsorted(keys[self.order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def __len__(self):
+        return len(self.points)
+
+    # Adds point (as last point) moving later points of sorted order, rebuilds grid if point is outside of it
+    def insert(self, p):
+        p = np.asarray(p, dtype=float).reshape(1, 2)
+        cell = np.floor((p[0] - self.origin) / self.cell_size).astype(int)
+        if len(self.points) == 0 or np.any(cell < 0) or np.any(cell >= self.shape):
+            self.build(np.vstack((self.points, p)))
+            return
+
+        c = self.cell_keys(cell)
+        self.order = np.insert(self.order, self.offsets[c + 1], len(self.points))
+        self.offsets[(c + 1):] += 1
+        self.points = np.vstack((self.points, p))
+
+    # Removes point at index (later points move one index lower)
+    def delete(self, i):
+        position = np.flatnonzero(self.order == i)[0]
+        c = np.searchsorted(self.offsets, position, side="right") - 1  # Cell of point
+        self.order = np.delete(self.order, position)
+        self.order[self.order > i] -= 1
+        self.offsets[(c + 1):] -= 1
+        self.points = np.delete(self.points, i, axis=0)
+
+    # Returns cell coordinates (X, Y) of points, clipped to grid
+    def cells_of(self, points):
+        cells = np.floor((points - self.origin) / self.cell_size).astype(int)
+        return np.clip(cells, 0, np.array(self.shape) - 1)
+
+    def cell_keys(self, cells):
+        return cells[..., 0] * self.shape[1] + cells[..., 1]
+
+    # Returns indexes of points in cells of squares (half width in cells) around cells (shape (Q, 2)),
+    # as flat array of point indexes with index of square each belongs to
+    def gather(self, cells, half):
+        offsets = np.arange(-half, half + 1)
+        x = cells[:, 0, np.newaxis, np.newaxis] + offsets[:, np.newaxis]
+        y = cells[:, 1, np.newaxis, np.newaxis] + offsets
+        x, y = np.broadcast_arrays(x, y)
+        inside = (x >= 0) & (x < self.shape[0]) & (y >= 0) & (y < self.shape[1])
+        squares = np.nonzero(inside)[0]
+        keys = x[inside] * self.shape[1] + y[inside]
+
+        # Expand cell ranges into point positions
+        starts, counts = self.offsets[keys], self.offsets[keys + 1] - self.offsets[keys]
+        total = int(counts.sum())
+        squares = np.repeat(squares, counts)
+        positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return self.order[positions], squares
+
+    # Returns k nearest points of each query point (shape (Q, 2)), as arrays of point indexes and distances
+    # (shape (Q, k), nearest first, lower index first if equally near), searching growing squares of cells
+    # around query points until no point outside could be nearer
+    def nearest_k(self, queries, k=1, block=65536):
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        k = min(k, len(self.points))
+        indexes = np.empty((len(queries), k), dtype=int)
+        distances = np.empty((len(queries), k))
+        if k == 0:
+            return indexes, distances
+
+        for start in range(0, len(queries), block):
+            qs = queries[start:(start + block)]
+            cells = self.cells_of(qs)
+            pending = np.arange(len(qs))
+            half = 0 if k == 1 else 1
+            while len(pending) > 0:
+                ids, squares = self.gather(cells[pending], half)
+                d = qs[pending[squares]] - self.points[ids]
+                d = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+
+                best_ids, best_d = nearest_candidates(ids, d, squares, len(pending), k, len(self.points))
+
+                # Done if square covers whole grid, or k-th nearest is nearer than any point outside square
+                lo = self.origin + (cells[pending] - half) * self.cell_size
+                hi = self.origin + (cells[pending] + half + 1) * self.cell_size
+                q = qs[pending]
+                bound = np.full(len(pending), np.inf)
+                for axis in range(2):
+                    bound = np.where(cells[pending, axis] - half > 0,
+                                     np.minimum(bound, q[:, axis] - lo[:, axis]), bound)
+                    bound = np.where(cells[pending, axis] + half < self.shape[axis] - 1,
+                                     np.minimum(bound, hi[:, axis] - q[:, axis]), bound)
+                done = best_d[:, -1] <= bound  # Not done if less than k found (infinite distance)
+
+                indexes[start + pending[done]] = best_ids[done]
+                distances[start + pending[done]] = best_d[done]
+
+                pending = pending[~done]
+                half = max(1, half * 2)
+
+        return indexes, distances
+
+    # Returns index of nearest point (lower index if equally near)
+    def nearest(self, p):
+        return int(self.nearest_k([p], k=1)[0][0, 0])
+
+    # Returns indexes of points within distance r of each query point (list of arrays, in index order)
+    def within_radius(self, queries, r):
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        ids, squares = self.gather(self.cells_of(queries), int(np.ceil(r / self.cell_size)))
+        d = queries[squares] - self.points[ids]
+        inside = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] <= r * r
+        ids, squares = ids[inside], squares[inside]
+        order = np.lexsort((ids, squares))
+        return np.split(ids[order], np.cumsum(np.bincount(squares, minlength=len(queries)))[:-1])
+
+    # Returns indexes of points inside axis-aligned box (including its border, in index order)
+    def within_box(self, low, high):
+        c1, c2 = self.cells_of(np.array([low, high], dtype=float))
+        keys = self.cell_keys(np.stack(np.meshgrid(np.arange(c1[0], c2[0] + 1), np.arange(c1[1], c2[1] + 1),
+                                                   indexing="ij"), axis=-1).reshape(-1, 2))
+        ids = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in keys] + [np.empty(0, int)])
+        ps = self.points[ids]
+        inside = np.all((ps >= low) & (ps <= high), axis=1)
+        return np.sort(ids[inside])
+
+    # Returns indexes of points inside each of boxes (lows and highs of shape (Q, 2))
+    def within_boxes(self, lows, highs):
+        return [self.within_box(low, high) for low, high in zip(lows, highs)]
+
+
+# Returns k nearest candidates (point indexes ids at distances d) of each of rows (squares are row of each candidate,
+# in order), as arrays of shape (rows, k) padded with missing index and infinite distance, sorting candidates
+# in matrix rows (slices of rows bounding memory)
+def nearest_candidates(ids, d, squares, rows, k, missing, size=2**22):
+    counts = np.bincount(squares, minlength=rows)
+    firsts = np.cumsum(counts) - counts
+    best_ids = np.full((rows, k), missing)
+    best_d = np.full((rows, k), np.inf)
+
+    start = 0
+    while start < rows:
+        # Take fewer rows if many candidates (duplicated points) would not fit in memory bound
+        end = min(start + 4096, rows)
+        end = min(end, start + max(1, size // max(int(counts[start:end].max()), k)))
+        width = max(int(counts[start:end].max()), k)
+
+        lo, hi = firsts[start], firsts[end - 1] + counts[end - 1]
+        r = squares[lo:hi] - start
+        c = np.arange(lo, hi) - firsts[squares[lo:hi]]
+        matrix_ids = np.full((end - start, width), missing)
+        matrix_d = np.full((end - start, width), np.inf)
+        matrix_ids[r, c] = ids[lo:hi]
+        matrix_d[r, c] = d[lo:hi]
+
+        # Sort by index, then by distance keeping lower index first if equally near
+        order = np.argsort(matrix_ids, axis=1)
+        matrix_ids = np.take_along_axis(matrix_ids, order, axis=1)
+        matrix_d = np.take_along_axis(matrix_d, order, axis=1)
+        order = np.argsort(matrix_d, axis=1, kind="stable")[:, :k]
+        best_ids[start:end] = np.take_along_axis(matrix_ids, order, axis=1)
+        best_d[start:end] = np.take_along_axis(matrix_d, order, axis=1)
+        start = end
+
+    return best_ids, best_d
@@ -0,0 +1,5 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Modules are in repository root
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
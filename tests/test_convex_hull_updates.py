@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+
+# Clicked inserts and deletes keep grid of clicked points in sync with convex hull points, grid is rebuilt on
+# first removal after points are generated (from points kept by updates)
+def test_grid_follows_point_updates():
+    QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+    import geomcalc
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = geomcalc.MainWindow()
+    window.txt_ch_pamount.setText("20")
+    random = np.random.RandomState(0)
+    for attempt in range(10):
+        window.ch_generate_points()
+        for step in range(30):
+            if step > 0 and random.rand() < 0.5:
+                p = window.ch.points[random.randint(len(window.ch.points))]  # Click on point
+                window.ch_update_point(tuple(p), remove=True)
+            else:
+                window.ch_update_point(tuple(random.uniform(0, 500, 2)))
+            if window.gridded_points is window.ch.points:
+                assert np.array_equal(window.points_grid.points, window.ch.points), (attempt, step)
+                assert np.array_equal(np.sort(window.points_grid.order), np.arange(len(window.ch.points)))
+    window.close()
+    app.processEvents()
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from modes import plane_triangulation as pt
+
+
+# Fewer than 3 points (or all duplicates) give no triangles instead of failing
+@pytest.mark.parametrize("points", [np.empty((0, 2)), [[1.0, 2.0]], [[1.0, 2.0], [3.0, 4.0]],
+                                    [[1.0, 2.0], [1.0, 2.0], [1.0, 2.0]]])
+def test_delaunay_too_few_points(points):
+    triangles = pt.delaunay(np.asarray(points, dtype=float))
+    assert triangles.shape == (0, 3)
+    assert triangles.dtype == int
+
+
+def test_delaunay_one_triangle():
+    triangles = pt.delaunay(np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]]))
+    assert sorted(triangles.ravel().tolist()) == [0, 1, 2]